@@ -0,0 +1,194 @@
+"""
+Bulk reports over the state of a Bank, computed with NumPy.
+
+BankAnalytics copies the live accounts and their transaction logs out of a Bank once, into flat NumPy arrays, and
+answers end-of-day reports over the copy with vectorized operations instead of one Bank call per account:
+
+    analytics = BankAnalytics(bank)
+    analytics.balances_at([day_end, day_end + MILLISECONDS_IN_1_DAY])   # accounts x times
+    analytics.top("balance", 10)
+    analytics.volume(day_start, day_end)
+
+The copy does not follow later operations on the bank; build a new BankAnalytics to report on a later state. Only
+live accounts are reported: an id merged into another account is reported as part of the account it was merged
+into.
+
+NumPy is only needed by this module, and is installed with the package's analytics extra. Bank and the rest of the
+package do not import it.
+"""
+
+from array import array
+from collections.abc import Sequence
+
+try:
+    import numpy as np
+    import numpy.typing as npt
+except ImportError as e:
+    raise ImportError("bank_analytics needs NumPy; install the analytics extra") from e
+
+from banking_system import CHECKPOINT_CODE, TRANSACTION_TYPE_CODES, Bank, TransactionType
+
+# metric name -> BankAnalytics column ranked by top()
+METRICS = {
+    "balance": "balances",
+    "held": "held",
+    "available": "available",
+    "activity": "total_transaction_values",
+    "spending": "total_withdrawn",
+}
+
+# transaction types counted in an account's total transaction value, and so in volume()
+VOLUME_TYPE_CODES = [
+    TRANSACTION_TYPE_CODES[t]
+    for t in (
+        TransactionType.DEPOSIT,
+        TransactionType.WITHDRAW,
+        TransactionType.TRANSFER_IN,
+        TransactionType.TRANSFER_OUT,
+        TransactionType.PAYMENT,
+    )
+]
+
+
+class BankAnalytics:
+    """
+    Live accounts of a Bank as NumPy columns, in the order of Bank.accounts, and their transaction logs
+    concatenated in the same order: the rows of account i are log_timestamps[offsets[i]:offsets[i + 1]], sorted by
+    timestamp, and log_balances holds the account's running balance after each row.
+    """
+
+    def __init__(self, bank: Bank) -> None:
+        table = bank.account_table
+        self.account_ids = list(bank.accounts)
+        numbers = np.fromiter(bank.accounts.values(), dtype=np.int64, count=len(bank.accounts))
+
+        def live(column: array[int]) -> npt.NDArray[np.int64]:
+            return np.array(column, dtype=np.int64)[numbers]
+
+        self.creation_times = live(table.creation_times)
+        self.balances = live(table.balances)
+        self.held = live(table.held)
+        self.available = self.balances - self.held
+        self.total_transaction_values = live(table.total_transaction_values)
+        self.total_withdrawn = live(table.total_withdrawn)
+
+        all_logs = [table.transactions[number] for number in bank.accounts.values()]
+        lengths = np.fromiter(
+            (len(log) if log is not None else 0 for log in all_logs), dtype=np.int64, count=len(all_logs)
+        )
+        self.offsets = np.zeros(len(all_logs) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        # joining the logs' buffers copies them in one pass without boxing a row
+        logs = [log for log in all_logs if log is not None]
+        self.log_timestamps = np.frombuffer(b"".join(log.timestamps for log in logs), dtype=np.int64)
+        self.log_amounts = np.frombuffer(b"".join(log.amounts for log in logs), dtype=np.int64)
+        self.log_types = np.frombuffer(b"".join(log.types for log in logs), dtype=np.int8)
+        self.log_balances = np.frombuffer(b"".join(log.balances for log in logs), dtype=np.int64)
+        # account index of every log row
+        self.log_accounts = np.repeat(np.arange(len(all_logs), dtype=np.int64), lengths)
+        self.history_horizon = bank.history_horizon
+        self.checkpoint_interval = bank.checkpoint_interval
+
+    def __len__(self) -> int:
+        return len(self.account_ids)
+
+    def balances_at(self, times: Sequence[int] | npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+        """
+        Balance of every account at each of times, as an accounts x times array: what Bank.get_balance reports for
+        the account's id, with 0 for accounts not yet created at that time. Each log row is placed among the sorted
+        times with one searchsorted, and a cumulative sum over those placements counts the rows at or before every
+        time, which indexes the running balance. Raises ValueError where get_balance would, for a time whose balance
+        was compacted.
+        """
+        times = np.asarray(times, dtype=np.int64)
+        order = np.argsort(times, kind="stable")
+        sorted_times = times[order]
+        num_accounts, num_times = len(self), len(times)
+
+        # a row at ts counts towards every time from the first one at or after ts
+        first_time = np.searchsorted(sorted_times, self.log_timestamps, side="left")
+        counts = np.bincount(
+            self.log_accounts * (num_times + 1) + first_time, minlength=num_accounts * (num_times + 1)
+        ).reshape(num_accounts, num_times + 1)[:, :num_times]
+        counts = np.cumsum(counts, axis=1)
+
+        self._check_not_folded(sorted_times, counts)
+        result = np.zeros((num_accounts, num_times), dtype=np.int64)
+        rows = self.offsets[:-1, None] + counts - 1
+        present = (counts > 0) & (self.creation_times[:, None] <= sorted_times[None, :])
+        result[present] = self.log_balances[rows[present]]
+
+        unsorted = np.empty_like(result)
+        unsorted[:, order] = result
+        return unsorted
+
+    def _check_not_folded(self, sorted_times: npt.NDArray[np.int64], counts: npt.NDArray[np.int64]) -> None:
+        """As TransactionLog.folded_at, for every account created by each time before the history horizon."""
+        early = sorted_times < self.history_horizon
+        if not early.any() or not len(self.log_types):
+            return
+
+        times = sorted_times[early]
+        next_rows = self.offsets[:-1, None] + counts[:, early]
+        has_next = next_rows < self.offsets[1:, None]
+        next_rows = np.minimum(next_rows, len(self.log_types) - 1)
+        folded = (
+            has_next
+            & (self.creation_times[:, None] <= times[None, :])
+            & (self.log_types[next_rows] == CHECKPOINT_CODE)
+            & (self.log_timestamps[next_rows] // self.checkpoint_interval == times // self.checkpoint_interval)
+        )
+        if folded.any():
+            time_at = int(times[np.flatnonzero(folded.any(axis=0))[0]])
+            raise ValueError(
+                f"The balance at {time_at} was compacted; before {self.history_horizon} only checkpoint balances are "
+                "retained"
+            )
+
+    def top(self, metric: str, n: int) -> list[tuple[str, int]]:
+        """
+        The n accounts with the highest metric, one of METRICS, highest first. Ties are ordered by creation time and
+        then account id, as Bank's leaderboards order them.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {', '.join(METRICS)}")
+
+        if n <= 0:
+            return []
+
+        values: npt.NDArray[np.int64] = getattr(self, METRICS[metric])
+        candidates = np.arange(len(values))
+        if n < len(values):
+            # everything tied with the n-th highest value, so ties are broken below as well
+            threshold = np.partition(values, len(values) - n)[len(values) - n]
+            candidates = np.flatnonzero(values >= threshold)
+
+        ids = np.array([self.account_ids[i] for i in candidates])
+        ranked = candidates[np.lexsort((ids, self.creation_times[candidates], -values[candidates]))][:n]
+        return [(self.account_ids[i], int(values[i])) for i in ranked]
+
+    def volume(self, start: int | None = None, end: int | None = None) -> int:
+        """
+        Total transaction value of all accounts from start, inclusive, to end, exclusive. Without bounds this is
+        the sum of the accounts' total transaction values; within bounds it sums the logged rows, so history
+        compacted into checkpoints no longer counts.
+        """
+        if start is None and end is None:
+            return int(self.total_transaction_values.sum())
+
+        mask = np.isin(self.log_types, VOLUME_TYPE_CODES)
+        if start is not None:
+            mask &= self.log_timestamps >= start
+        if end is not None:
+            mask &= self.log_timestamps < end
+        return int(np.abs(self.log_amounts[mask]).sum())
+
+    def balance_histogram(
+        self, bins: int | Sequence[int] = 10
+    ) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.float64]]:
+        """Counts of current balances per bin and the bin edges, as numpy.histogram returns them."""
+        counts, edges = np.histogram(self.balances, bins=bins)
+        return counts, edges
+
+    def balance_percentiles(self, percentiles: Sequence[float]) -> npt.NDArray[np.float64]:
+        return np.percentile(self.balances, percentiles) if len(self) else np.full(len(percentiles), np.nan)
@@ -0,0 +1,580 @@
+"""
+Durable Bank: a write-ahead log of operations plus periodic binary snapshots.
+
+Every operation run through PersistentBank is appended to the WAL, and by default written and fsynced, before its
+result is returned. Reads are logged too, since every timestamped operation advances transfer expiry and scheduled
+payments and replay has to advance time at the same points. With group_commit set above 1, appends are
+group-committed instead: the WAL is written and fsynced once every group_commit records, or on commit(), so a crash
+can lose up to group_commit - 1 operations whose results were already returned. checkpoint() writes the whole Bank
+state as a compact binary snapshot and then truncates the WAL. Recovery loads the snapshot (memory-mapped) and
+replays WAL records newer than it.
+
+WAL record:      <u32 payload length> <u32 crc32 of payload> <payload>
+WAL payload:     <u64 sequence number> <u8 operation code> <arguments>
+Snapshot:        SNAPSHOT_MAGIC <u64 sequence number of the last applied record> <bank state>
+                 The bank state is stored column-wise: every AccountTable column, the AccountAliases forest, the
+                 transaction logs of all accounts concatenated with their lengths, and pending transfers and
+                 payments as one array per field, so loading copies whole buffers instead of decoding a record per
+                 account. Snapshots of earlier versions, which store one record per live account (BANKSNP2, and
+                 BANKSNP1 without the compaction state), are still read.
+Ints are signed little-endian 64 bit, strings are <u32 byte length> <utf-8 bytes>, arrays are <u32 item count>
+<items>, and a list of strings is the array of their lengths in characters followed by their concatenation. A torn
+or corrupt record at the end of the WAL is treated as never written.
+"""
+
+import gc
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from itertools import accumulate, pairwise
+from typing import IO, Any
+
+from banking_system import (
+    DEFAULT_CHECKPOINT_INTERVAL,
+    QUERY_COMMANDS,
+    AccountRow,
+    Bank,
+    Leaderboard,
+    Payment,
+    PaymentArchive,
+    PaymentScheduler,
+    PaymentType,
+    TransactionLog,
+    Transfer,
+)
+
+SNAPSHOT_MAGIC = b"BANKSNP3"
+SNAPSHOT_MAGIC_V2 = b"BANKSNP2"
+SNAPSHOT_MAGIC_V1 = b"BANKSNP1"
+SNAPSHOT_FILE = "bank.snapshot"
+WAL_FILE = "bank.wal"
+DEFAULT_GROUP_COMMIT = 1
+
+OPERATIONS = list(QUERY_COMMANDS)
+OPERATION_CODES = {op: code for code, op in enumerate(OPERATIONS)}
+PAYMENT_TYPES = list(PaymentType)
+
+INT = struct.Struct("<q")
+U8 = struct.Struct("<B")
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+WAL_HEADER = struct.Struct("<II")
+
+
+class Writer:
+    def __init__(self) -> None:
+        self.buf = bytearray()
+
+    def i64(self, value: int) -> None:
+        self.buf += INT.pack(value)
+
+    def u8(self, value: int) -> None:
+        self.buf += U8.pack(value)
+
+    def u32(self, value: int) -> None:
+        self.buf += U32.pack(value)
+
+    def u64(self, value: int) -> None:
+        self.buf += U64.pack(value)
+
+    def string(self, value: str) -> None:
+        encoded = value.encode()
+        self.buf += U32.pack(len(encoded))
+        self.buf += encoded
+
+    def typed_array(self, values: array) -> None:  # type: ignore[type-arg]
+        self.buf += U32.pack(len(values))
+        self.buf += values.tobytes()
+
+    def joined_arrays(self, values: list[array]) -> None:  # type: ignore[type-arg]
+        """Writes arrays of one typecode as a single array, read back with typed_array."""
+        self.buf += U32.pack(sum(map(len, values)))
+        self.buf += b"".join(values)
+
+    def strings(self, values: list[str]) -> None:
+        self.typed_array(array("q", map(len, values)))
+        self.string("".join(values))
+
+
+class Reader:
+    def __init__(self, data: memoryview | bytes) -> None:
+        self.data = data
+        self.pos = 0
+
+    def _unpack(self, fmt: struct.Struct) -> int:
+        (value,) = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return int(value)
+
+    def i64(self) -> int:
+        return self._unpack(INT)
+
+    def u8(self) -> int:
+        return self._unpack(U8)
+
+    def u32(self) -> int:
+        return self._unpack(U32)
+
+    def u64(self) -> int:
+        return self._unpack(U64)
+
+    def string(self) -> str:
+        length = self.u32()
+        value = bytes(self.data[self.pos : self.pos + length]).decode()
+        self.pos += length
+        return value
+
+    def typed_array(self, typecode: str) -> array:  # type: ignore[type-arg]
+        values = array(typecode)
+        length = self.u32()
+        end = self.pos + length * values.itemsize
+        values.frombytes(self.data[self.pos : end])
+        self.pos = end
+        return values
+
+    def strings(self) -> list[str]:
+        lengths = self.typed_array("q")
+        text = self.string()
+        return [text[start:end] for start, end in spans(lengths)]
+
+
+def spans(lengths: Iterable[int]) -> Iterator[tuple[int, int]]:
+    """Start and end of each of consecutive slices of the given lengths."""
+    return pairwise(accumulate(lengths, initial=0))
+
+
+def encode_operation(seq: int, op: str, args: tuple[Any, ...]) -> bytes:
+    w = Writer()
+    w.u64(seq)
+    w.u8(OPERATION_CODES[op])
+    for convert, arg in zip(QUERY_COMMANDS[op][1], args, strict=True):
+        if convert is int:
+            w.i64(arg)
+        else:
+            w.string(arg)
+
+    return bytes(w.buf)
+
+
+def decode_operation(payload: bytes) -> tuple[int, str, tuple[Any, ...]]:
+    r = Reader(payload)
+    seq = r.u64()
+    op = OPERATIONS[r.u8()]
+    args = tuple(r.i64() if convert is int else r.string() for convert in QUERY_COMMANDS[op][1])
+    return seq, op, args
+
+
+def read_wal(path: str) -> tuple[list[tuple[int, str, tuple[Any, ...]]], int]:
+    """Returns the decoded records and the length of the valid prefix of the file."""
+    if not os.path.exists(path):
+        return [], 0
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    records = []
+    pos = 0
+    while pos + WAL_HEADER.size <= len(data):
+        length, crc = WAL_HEADER.unpack_from(data, pos)
+        payload = data[pos + WAL_HEADER.size : pos + WAL_HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+
+        records.append(decode_operation(payload))
+        pos += WAL_HEADER.size + length
+
+    return records, pos
+
+
+class WriteAheadLog:
+    def __init__(self, path: str, group_commit: int = DEFAULT_GROUP_COMMIT) -> None:
+        self.path = path
+        self.group_commit = group_commit
+        self.pending = bytearray()
+        self.pending_records = 0
+        _, valid_length = read_wal(path)
+        self.file: IO[bytes] = open(path, "ab")
+        # drop a torn tail left by a crash mid-write
+        self.file.truncate(valid_length)
+
+    def append(self, seq: int, op: str, args: tuple[Any, ...]) -> None:
+        payload = encode_operation(seq, op, args)
+        self.pending += WAL_HEADER.pack(len(payload), zlib.crc32(payload))
+        self.pending += payload
+        self.pending_records += 1
+        if self.pending_records >= self.group_commit:
+            self.commit()
+
+    def commit(self) -> None:
+        if not self.pending:
+            return
+
+        self.file.write(self.pending)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending.clear()
+        self.pending_records = 0
+
+    def truncate(self) -> None:
+        self.commit()
+        self.file.truncate(0)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        self.commit()
+        self.file.close()
+
+
+def encode_snapshot(bank: Bank, seq: int) -> bytes:
+    w = Writer()
+    w.buf += SNAPSHOT_MAGIC
+    w.u64(seq)
+    w.i64(bank.transfer_ordinal)
+    w.i64(bank.payment_ordinal)
+    w.i64(bank.history_horizon)
+    w.i64(bank.next_compaction)
+
+    # Accounts are written with their numbers, merged ones included, so payments, transfers and the archive keep
+    # referring to the same nodes.
+    w.typed_array(bank.aliases.parents)
+    w.strings(bank.aliases.account_ids)
+    w.typed_array(array("q", bank.accounts.values()))
+
+    table = bank.account_table
+    w.typed_array(table.creation_times)
+    w.typed_array(table.balances)
+    w.typed_array(table.held)
+    w.typed_array(table.total_transaction_values)
+    w.typed_array(table.total_withdrawn)
+    # accounts without transactions or payments are written as empty ones
+    w.typed_array(array("q", [len(log) if log is not None else 0 for log in table.transactions]))
+    logs = [log for log in table.transactions if log is not None]
+    w.joined_arrays([log.timestamps for log in logs])
+    w.joined_arrays([log.amounts for log in logs])
+    w.joined_arrays([log.types for log in logs])
+    w.joined_arrays([log.balances for log in logs])
+    w.typed_array(array("q", [len(payment_ids or ()) for payment_ids in table.payment_ids]))
+    w.strings([payment_id for payment_ids in table.payment_ids for payment_id in payment_ids or ()])
+
+    transfers = bank.pending_transfers
+    w.typed_array(array("q", transfers))
+    w.typed_array(array("q", [transfer.ts for transfer in transfers.values()]))
+    w.typed_array(array("q", [transfer.source for transfer in transfers.values()]))
+    w.typed_array(array("q", [transfer.target for transfer in transfers.values()]))
+    w.typed_array(array("q", [transfer.amount for transfer in transfers.values()]))
+
+    # The scheduler heap also holds entries of cancelled payments; only live ones are kept.
+    scheduled = [entry for entry in bank.payment_scheduler._heap if entry[2] in bank.scheduled_payments]
+    w.typed_array(array("q", [ordinal for _, ordinal, _ in scheduled]))
+    write_payments(w, [bank.scheduled_payments[payment_id] for _, _, payment_id in scheduled])
+    write_payments(w, list(bank.completed_payments.values()))
+
+    w.typed_array(bank.payment_archive.owners)
+
+    return bytes(w.buf)
+
+
+def write_payments(w: Writer, payments: list[Payment]) -> None:
+    w.strings([payment.payment_id for payment in payments])
+    w.typed_array(array("q", [payment.ts for payment in payments]))
+    w.typed_array(array("q", [payment.owner for payment in payments]))
+    w.typed_array(array("q", [payment.amount for payment in payments]))
+    w.typed_array(array("b", [PAYMENT_TYPES.index(payment.type or PaymentType.OUTGOING) for payment in payments]))
+
+
+def read_payments(r: Reader) -> list[Payment]:
+    payment_ids = r.strings()
+    timestamps, owners, amounts, types = r.typed_array("q"), r.typed_array("q"), r.typed_array("q"), r.typed_array("b")
+    return [
+        Payment(ts, owner, payment_id, amount, PAYMENT_TYPES[code])
+        for payment_id, ts, owner, amount, code in zip(payment_ids, timestamps, owners, amounts, types, strict=True)
+    ]
+
+
+def read_payment(r: Reader, bank: Bank) -> Payment:
+    payment_id = r.string()
+    ts = r.i64()
+    account_id = r.string()
+    amount = r.i64()
+    number = bank.accounts[account_id]
+    bank.account_table.payments(number).append(payment_id)
+    return Payment(ts, number, payment_id, amount, PAYMENT_TYPES[r.u8()])
+
+
+def decode_snapshot(data: memoryview | bytes) -> tuple[Bank, int]:
+    magic = bytes(data[: len(SNAPSHOT_MAGIC)])
+    if magic not in (SNAPSHOT_MAGIC, SNAPSHOT_MAGIC_V2, SNAPSHOT_MAGIC_V1):
+        raise ValueError("Not a bank snapshot")
+
+    # Everything decoded lives as long as the bank, so cyclic collections while it is built would only traverse
+    # the same new objects over and over.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return decode_snapshot_v3(data) if magic == SNAPSHOT_MAGIC else decode_snapshot_v2(data, magic)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def decode_snapshot_v3(data: memoryview | bytes) -> tuple[Bank, int]:
+    """
+    Reads a BANKSNP3 snapshot. Transaction logs stay views over the concatenated columns until first touched, so
+    what remains is the account id dicts, the payments and the two leaderboards: about 4.5 µs per account on one
+    core, 2.0-2.6 s for 500k accounts with 1M operations behind them.
+    """
+    r = Reader(data)
+    r.pos = len(SNAPSHOT_MAGIC)
+    seq = r.u64()
+    bank = Bank()
+    bank.transfer_ordinal = r.i64()
+    bank.payment_ordinal = r.i64()
+    bank.history_horizon = r.i64()
+    bank.next_compaction = r.i64()
+
+    aliases = bank.aliases
+    aliases.parents = r.typed_array("q")
+    aliases.account_ids = r.strings()
+    # an id created again after a merge maps to its latest, highest node
+    aliases.nodes = {account_id: node for node, account_id in enumerate(aliases.account_ids)}
+    bank.accounts = {aliases.account_ids[number]: number for number in r.typed_array("q")}
+
+    table = bank.account_table
+    table.creation_times = r.typed_array("q")
+    table.balances = r.typed_array("q")
+    table.held = r.typed_array("q")
+    table.total_transaction_values = r.typed_array("q")
+    table.total_withdrawn = r.typed_array("q")
+    log_lengths = r.typed_array("q")
+    columns = (r.typed_array("q"), r.typed_array("q"), r.typed_array("b"), r.typed_array("q"))
+    table.transactions = [
+        TransactionLog.over_columns(columns, start, end) if end > start else None for start, end in spans(log_lengths)
+    ]
+    payment_id_counts = r.typed_array("q")
+    payment_ids = r.strings()
+    table.payment_ids = [payment_ids[start:end] or None for start, end in spans(payment_id_counts)]
+
+    ordinals = r.typed_array("q")
+    transfers = zip(r.typed_array("q"), r.typed_array("q"), r.typed_array("q"), r.typed_array("q"), strict=True)
+    bank.pending_transfers = {
+        ordinal: Transfer(*transfer) for ordinal, transfer in zip(ordinals, transfers, strict=True)
+    }
+    bank.transfer_expiry_queue = deque(bank.pending_transfers)
+
+    ordinals = r.typed_array("q")
+    scheduled = read_payments(r)
+    bank.scheduled_payments = {payment.payment_id: payment for payment in scheduled}
+    bank.payment_scheduler = PaymentScheduler(
+        (payment.ts, ordinal, payment.payment_id) for payment, ordinal in zip(scheduled, ordinals, strict=True)
+    )
+    bank.completed_payments = {payment.payment_id: payment for payment in read_payments(r)}
+
+    bank.payment_archive.owners = r.typed_array("q")
+
+    # Sorting account numbers by one integer is much cheaper than sorting the entry tuples, and SortedList only
+    # makes one pass over entries that arrive in order. A stable sort by total over numbers in creation order
+    # gives the leaderboard order.
+    created = table.creation_times
+    live = sorted(bank.accounts.values(), key=created.__getitem__)
+    account_ids = aliases.account_ids
+    totals = table.total_transaction_values
+    bank.activity_leaderboard = Leaderboard(
+        (-totals[number], created[number], account_ids[number])
+        for number in sorted(live, key=totals.__getitem__, reverse=True)
+    )
+    withdrawn = table.total_withdrawn
+    bank.spenders_leaderboard = Leaderboard(
+        (-withdrawn[number], created[number], account_ids[number])
+        for number in sorted(live, key=withdrawn.__getitem__, reverse=True)
+    )
+
+    return bank, seq
+
+
+def decode_snapshot_v2(data: memoryview | bytes, magic: bytes) -> tuple[Bank, int]:
+    """Reads a BANKSNP2 or BANKSNP1 snapshot, which stores one record per live account."""
+    r = Reader(data)
+    r.pos = len(SNAPSHOT_MAGIC)
+    seq = r.u64()
+    bank = Bank()
+    bank.transfer_ordinal = r.i64()
+    bank.payment_ordinal = r.i64()
+
+    account_nodes = []
+    for _ in range(r.u32()):
+        account_id = r.string()
+        creation_time, balance, held = r.i64(), r.i64(), r.i64()
+        total_transaction_value, total_withdrawn = r.i64(), r.i64()
+        log = TransactionLog.from_columns(
+            r.typed_array("q"), r.typed_array("q"), r.typed_array("b"), r.typed_array("q")
+        )
+        row: AccountRow = (creation_time, balance, held, total_transaction_value, total_withdrawn, log or None, None)
+        account_nodes.append(bank._add_account(account_id, row))
+
+    for _ in range(r.u32()):
+        ordinal = r.i64()
+        ts = r.i64()
+        source = bank.aliases.nodes[r.string()]
+        target = bank.aliases.nodes[r.string()]
+        bank.pending_transfers[ordinal] = Transfer(ts, source, target, r.i64())
+    bank.transfer_expiry_queue = deque(bank.pending_transfers)
+
+    for _ in range(r.u32()):
+        ordinal = r.i64()
+        payment = read_payment(r, bank)
+        bank.scheduled_payments[payment.payment_id] = payment
+        bank.payment_scheduler.push(payment.ts, ordinal, payment.payment_id)
+
+    for _ in range(r.u32()):
+        payment = read_payment(r, bank)
+        bank.completed_payments[payment.payment_id] = payment
+
+    for _ in range(r.u32()):
+        merged_id = r.string()
+        target_id = r.string()
+        if merged_id in bank.accounts:
+            continue
+        bank._add_merged_alias(merged_id, bank.accounts[target_id])
+
+    if magic == SNAPSHOT_MAGIC_V2:
+        bank.history_horizon = r.i64()
+        bank.next_compaction = r.i64()
+        bank.payment_archive.owners = array(
+            "q",
+            [
+                position if position == PaymentArchive.NOT_ARCHIVED else account_nodes[position]
+                for position in r.typed_array("q")
+            ],
+        )
+
+    return bank, seq
+
+
+def write_snapshot(bank: Bank, seq: int, path: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_snapshot(bank, seq))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str) -> tuple[Bank, int]:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            return decode_snapshot(view)
+        finally:
+            view.release()
+
+
+def _logged(op: str) -> Callable[..., Any]:
+    def method(self: "PersistentBank", *args: Any) -> Any:
+        return self.execute(op, *args)
+
+    method.__name__ = QUERY_COMMANDS[op][0]
+    return method
+
+
+class PersistentBank:
+    """
+    Bank whose operations are logged to directory/bank.wal and periodically snapshotted to directory/bank.snapshot.
+    Opening an existing directory recovers the state it holds. Each operation is fsynced before it returns unless
+    group_commit is above 1; see the module docstring for what a crash can then lose. snapshot_every, when set,
+    checkpoints after that many operations. history_retention and checkpoint_interval configure the Bank's history
+    compaction; recovery replays the WAL with them, so a directory should be reopened with the settings it was
+    written with.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        group_commit: int = DEFAULT_GROUP_COMMIT,
+        snapshot_every: int | None = None,
+        history_retention: int | None = None,
+        checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.wal_path = os.path.join(directory, WAL_FILE)
+        self.snapshot_every = snapshot_every
+        self.history_retention = history_retention
+        self.checkpoint_interval = checkpoint_interval
+
+        self.bank, self.seq = self.recover()
+        self.ops_since_snapshot = 0
+        self.wal = WriteAheadLog(self.wal_path, group_commit)
+
+    def __enter__(self) -> "PersistentBank":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def recover(self) -> tuple[Bank, int]:
+        bank, seq = read_snapshot(self.snapshot_path) if os.path.exists(self.snapshot_path) else (Bank(), 0)
+        bank.history_retention = self.history_retention
+        bank.checkpoint_interval = self.checkpoint_interval
+        records, _ = read_wal(self.wal_path)
+        for record_seq, op, args in records:
+            # records up to seq were already in the snapshot when a crash hit before the WAL was truncated
+            if record_seq <= seq:
+                continue
+
+            try:
+                getattr(bank, QUERY_COMMANDS[op][0])(*args)
+            except ValueError:
+                # it raised when it first ran too, after advancing time
+                pass
+            seq = record_seq
+
+        return bank, seq
+
+    def execute(self, op: str, *args: Any) -> Any:
+        try:
+            res = getattr(self.bank, QUERY_COMMANDS[op][0])(*args)
+        except ValueError:
+            # a read of compacted history raises after advancing time, so replay has to run it too
+            self.log(op, args)
+            raise
+
+        self.log(op, args)
+        return res
+
+    def log(self, op: str, args: tuple[Any, ...]) -> None:
+        self.seq += 1
+        self.wal.append(self.seq, op, args)
+
+        self.ops_since_snapshot += 1
+        if self.snapshot_every is not None and self.ops_since_snapshot >= self.snapshot_every:
+            self.checkpoint()
+
+    def commit(self) -> None:
+        self.wal.commit()
+
+    def checkpoint(self) -> None:
+        self.wal.commit()
+        write_snapshot(self.bank, self.seq, self.snapshot_path)
+        self.wal.truncate()
+        self.ops_since_snapshot = 0
+
+    def close(self) -> None:
+        self.wal.close()
+
+    create_account = _logged("CREATE_ACCOUNT")
+    deposit = _logged("DEPOSIT")
+    pay = _logged("PAY")
+    transfer = _logged("TRANSFER")
+    accept_transfer = _logged("ACCEPT_TRANSFER")
+    top_activity = _logged("TOP_ACTIVITY")
+    top_spenders = _logged("TOP_SPENDERS")
+    get_payment_status = _logged("GET_PAYMENT_STATUS")
+    schedule_payment = _logged("SCHEDULE_PAYMENT")
+    cancel_payment = _logged("CANCEL_PAYMENT")
+    merge_accounts = _logged("MERGE_ACCOUNTS")
+    get_balance = _logged("GET_BALANCE")
@@ -0,0 +1,5 @@
+"""
+Benchmarks for the banking system, in-memory database and cloud storage implementations.
+
+Run a benchmark as a module from the repository root, e.g. python -m benchmarks.transfer_expiry
+"""
@@ -0,0 +1,47 @@
+"""
+Measures what an account costs Bank: memory per account, and the throughput of operations that look accounts up.
+"""
+
+import tracemalloc
+from time import perf_counter
+
+from banking_system import QUERY_COMMANDS, Bank
+from benchmarks.workloads import bank_payments
+
+ACCOUNTS = 100_000
+SIZE = 200_000
+
+
+def bytes_per_account(deposit: bool) -> float:
+    account_ids = [f"account{i}" for i in range(ACCOUNTS)]
+    tracemalloc.start()
+    bank = Bank()
+    for i, account_id in enumerate(account_ids):
+        bank.create_account(str(2 * i + 1), account_id)
+        if deposit:
+            bank.deposit(str(2 * i + 2), account_id, 100)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del bank
+
+    return size / ACCOUNTS
+
+
+def payments_throughput() -> float:
+    ops = list(bank_payments(SIZE, seed=42))
+    bank = Bank()
+    methods = {op: getattr(bank, method_name) for op, (method_name, _) in QUERY_COMMANDS.items()}
+    start = perf_counter()
+    for op, args in ops:
+        methods[op](*args)
+    return len(ops) / (perf_counter() - start)
+
+
+def main() -> None:
+    print(f"bytes per account: {bytes_per_account(deposit=False):,.0f}")
+    print(f"bytes per account with a deposit: {bytes_per_account(deposit=True):,.0f}")
+    print(f"bank-payments ops/sec: {payments_throughput():,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares end-of-day reports computed through Bank's own queries, one call per account and time, with the same
+reports from bank_analytics, including the cost of copying the bank into NumPy arrays.
+"""
+
+import random
+from collections.abc import Callable
+from time import perf_counter
+
+from bank_analytics import BankAnalytics
+from banking_system import MILLISECONDS_IN_1_DAY, Bank
+
+ACCOUNTS = 10_000
+DAYS = 30
+OPERATIONS_PER_DAY = 20_000
+TOP = 10
+REPEATS = 3
+
+
+def build_bank() -> tuple[Bank, int]:
+    rng = random.Random(42)
+    bank = Bank()
+    ts = 0
+    for i in range(ACCOUNTS):
+        ts += 1
+        bank.create_account(str(ts), f"account{i}")
+        bank.deposit(str(ts), f"account{i}", 10**6)
+
+    step = MILLISECONDS_IN_1_DAY // OPERATIONS_PER_DAY
+    for _ in range(DAYS * OPERATIONS_PER_DAY):
+        ts += step
+        account_id = f"account{rng.randrange(ACCOUNTS)}"
+        if rng.random() < 0.5:
+            bank.deposit(str(ts), account_id, rng.randint(1, 1_000))
+        else:
+            bank.pay(ts, account_id, rng.randint(1, 500))
+
+    return bank, ts
+
+
+def per_call_reports(bank: Bank, ts: int, times: list[int]) -> None:
+    balances = [[bank.get_balance(ts, account_id, t) for t in times] for account_id in bank.accounts]
+    sorted(row[-1] or 0 for row in balances)
+    bank.top_activity(str(ts), TOP)
+    bank.top_spenders(str(ts), TOP)
+
+
+def analytics_reports(bank: Bank, times: list[int]) -> None:
+    analytics = BankAnalytics(bank)
+    analytics.balances_at(times)
+    analytics.balance_percentiles([50, 90, 99])
+    analytics.top("activity", TOP)
+    analytics.top("spending", TOP)
+    analytics.top("balance", TOP)
+
+
+def best_time(run: Callable[[], object]) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = perf_counter()
+        run()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    bank, ts = build_bank()
+    times = [ACCOUNTS + day * MILLISECONDS_IN_1_DAY for day in range(1, DAYS + 1)]
+    print(f"{ACCOUNTS:,} accounts, {DAYS} end-of-day balances each, best of {REPEATS}")
+
+    per_call = best_time(lambda: per_call_reports(bank, ts, times))
+    print(f"per-call Bank queries: {per_call * 1e3:.0f} ms")
+    vectorized = best_time(lambda: analytics_reports(bank, times))
+    copy = best_time(lambda: BankAnalytics(bank))
+    print(f"bank_analytics:        {vectorized * 1e3:.0f} ms, of which {copy * 1e3:.0f} ms copying the bank")
+    print(f"speedup:               {per_call / vectorized:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compares Bank.apply_batch against calling the Bank methods one at a time on the same payment-heavy stream, both as
+generated and with the top queries removed, as in an ingestion pipeline. Each side is timed on a fresh Bank, best of
+REPEATS runs. The runs of the two sides alternate: timing all runs of one side first skewed the comparison by up to 15%.
+"""
+
+import gc
+from collections.abc import Callable
+from time import perf_counter
+from typing import Any
+
+from banking_system import BATCH_COMMANDS, QUERY_COMMANDS, Bank
+from benchmarks.workloads import Operation, bank_payments
+
+SIZES = [10_000, 100_000]
+REPEATS = 5
+COLUMN_NAMES = ("account_ids", "amounts", "targets", "extras")
+
+
+def to_columns(ops: list[Operation]) -> dict[str, list[Any]]:
+    columns: dict[str, list[Any]] = {name: [] for name in ("ops", "timestamps", *COLUMN_NAMES)}
+    for op, args in ops:
+        columns["ops"].append(op)
+        columns["timestamps"].append(args[0])
+        row: dict[str, Any] = {"account_ids": "", "amounts": 0, "targets": "", "extras": 0}
+        row.update(zip(BATCH_COMMANDS[op][1], args[1:], strict=True))
+        for name, value in row.items():
+            columns[name].append(value)
+
+    return columns
+
+
+def timed(run: Callable[[Bank], list[Any]]) -> tuple[float, list[Any]]:
+    # so neither side pays for collecting the other's garbage
+    gc.collect()
+    bank = Bank()
+    start = perf_counter()
+    results = run(bank)
+    return perf_counter() - start, results
+
+
+def compare(ops: list[Operation]) -> tuple[float, float]:
+    columns = to_columns(ops)
+    single_elapsed = batch_elapsed = float("inf")
+    for _ in range(REPEATS):
+        elapsed, single = timed(lambda bank: [getattr(bank, QUERY_COMMANDS[op][0])(*args) for op, args in ops])
+        single_elapsed = min(single_elapsed, elapsed)
+        elapsed, batched = timed(lambda bank: bank.apply_batch(**columns))
+        batch_elapsed = min(batch_elapsed, elapsed)
+
+    assert single == batched
+    return single_elapsed, batch_elapsed
+
+
+def main() -> None:
+    print(f"best of {REPEATS}")
+    print(f"{'stream':>8} {'ops':>10} {'one at a time (s)':>18} {'apply_batch (s)':>16} {'speedup':>8}")
+    for size in SIZES:
+        ops = list(bank_payments(size, seed=42))
+        streams = [("mixed", ops), ("ingest", [(op, args) for op, args in ops if not op.startswith("TOP_")])]
+        for name, stream in streams:
+            single, batch = compare(stream)
+            print(f"{name:>8} {len(stream):>10} {single:>18.3f} {batch:>16.3f} {single / batch:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
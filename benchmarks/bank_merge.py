@@ -0,0 +1,57 @@
+"""
+Measures Bank.merge_accounts against the number of payments in the bank.
+
+Merging two accounts should cost the same regardless of how many payments other accounts have made.
+"""
+
+from time import perf_counter
+
+from banking_system import MILLISECONDS_IN_1_DAY, Bank
+
+PAYMENT_SIZES = [1_000, 10_000, 100_000]
+MERGES = 1_000
+OTHER_ACCOUNTS = 100
+
+
+def build_bank(payments: int) -> tuple[Bank, int]:
+    bank = Bank()
+    ts = 1
+    for i in range(OTHER_ACCOUNTS):
+        bank.create_account(str(ts), f"other{i}")
+        bank.deposit(str(ts + 1), f"other{i}", 10**9)
+        ts += 2
+    for i in range(payments):
+        bank.pay(ts, f"other{i % OTHER_ACCOUNTS}", 100)
+        ts += 1
+    # a day later the cashbacks above have been performed; the ones below stay scheduled
+    ts += MILLISECONDS_IN_1_DAY
+    for i in range(payments // 2):
+        bank.pay(ts, f"other{i % OTHER_ACCOUNTS}", 100)
+        ts += 1
+
+    for i in range(2 * MERGES):
+        bank.create_account(str(ts), f"merged{i}")
+        bank.deposit(str(ts + 1), f"merged{i}", 1_000)
+        bank.pay(ts + 2, f"merged{i}", 100)
+        ts += 3
+
+    return bank, ts
+
+
+def time_merges(bank: Bank, ts: int) -> float:
+    start = perf_counter()
+    for i in range(MERGES):
+        bank.merge_accounts(ts + i, f"merged{2 * i}", f"merged{2 * i + 1}")
+    return perf_counter() - start
+
+
+def main() -> None:
+    print(f"{'payments':>10} {'merge (us)':>11}")
+    for payments in PAYMENT_SIZES:
+        bank, ts = build_bank(payments)
+        elapsed = time_merges(bank, ts)
+        print(f"{payments:>10} {elapsed / MERGES * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Measures Bank memory on ever longer streams at a steady rate of operations, with and without history retention.
+
+Without retention every transaction and completed payment is kept, so memory grows with the length of the stream;
+with it, memory should level off once the stream is longer than the retention period.
+"""
+
+import random
+import tracemalloc
+from collections.abc import Iterator
+
+from banking_system import MILLISECONDS_IN_1_DAY, Bank
+
+ACCOUNTS = 1_000
+OPERATIONS_PER_DAY = 50_000
+DAYS = [2, 4, 8]
+RETENTION = MILLISECONDS_IN_1_DAY
+
+
+def operations(days: int) -> Iterator[tuple[str, tuple[object, ...]]]:
+    rng = random.Random(42)
+    step = MILLISECONDS_IN_1_DAY // OPERATIONS_PER_DAY
+    ts = 0
+    for i in range(ACCOUNTS):
+        ts += 1
+        yield "create_account", (ts, f"account{i}")
+        yield "deposit", (ts, f"account{i}", 10**9)
+
+    for _ in range(days * OPERATIONS_PER_DAY):
+        ts += step
+        account_id = f"account{rng.randrange(ACCOUNTS)}"
+        r = rng.random()
+        if r < 0.4:
+            yield "pay", (ts, account_id, rng.randint(1, 500))
+        elif r < 0.6:
+            yield "schedule_payment", (ts, account_id, rng.randint(1, 500), rng.randint(1, MILLISECONDS_IN_1_DAY))
+        else:
+            yield "deposit", (ts, account_id, rng.randint(1, 1_000))
+
+
+def memory(days: int, history_retention: int | None) -> int:
+    tracemalloc.start()
+    bank = Bank(history_retention=history_retention)
+    for method_name, args in operations(days):
+        getattr(bank, method_name)(*args)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del bank
+
+    return size
+
+
+def main() -> None:
+    print(f"{'days':>5} {'no retention (MB)':>18} {'1 day retention (MB)':>21}")
+    for days in DAYS:
+        print(f"{days:>5} {memory(days, None) / 2**20:>18.1f} {memory(days, RETENTION) / 2**20:>21.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Measures what change capture costs: every workload is run on a plain instance and on one appending its changes to a
+ChangeLog, and the throughput of the two is compared along with how many changes the workload produced and how fast
+a consumer reads them back.
+"""
+
+from time import perf_counter
+from typing import Any
+
+from benchmarks.workloads import WORKLOADS, Operation, Workload
+from change_log import ChangeLog
+
+SIZE = 100_000
+
+
+def run(workload: Workload, ops: list[Operation], changes: ChangeLog | None) -> float:
+    system: Any = workload.factory()
+    system.changes = changes
+
+    methods = {op: getattr(system, method_name) for op, (method_name, _) in workload.commands.items()}
+    start = perf_counter()
+    for op, args in ops:
+        methods[op](*args)
+    return perf_counter() - start
+
+
+def consume(changes: ChangeLog) -> float:
+    start = perf_counter()
+    position = 0
+    for change in changes.read(position):
+        position = change.seq + 1
+    return perf_counter() - start
+
+
+def main() -> None:
+    print(f"{'workload':>24} {'plain ops/sec':>14} {'capturing':>12} {'overhead':>9} {'changes':>8} {'read/sec':>12}")
+    for name, workload in WORKLOADS.items():
+        ops = list(workload.generate(SIZE, 42))
+        plain = run(workload, ops, None)
+        changes = ChangeLog(capacity=len(ops) * 4)
+        capturing = run(workload, ops, changes)
+        read = consume(changes)
+        print(
+            f"{name:>24} {len(ops) / plain:>14,.0f} {len(ops) / capturing:>12,.0f} {capturing / plain - 1:>8.1%}"
+            f" {changes.next_seq:>8,} {changes.next_seq / read if read else 0:>12,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
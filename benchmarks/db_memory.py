@@ -0,0 +1,64 @@
+"""
+Measures how much memory InMemoryDB uses per stored field, for records with and without ttls and before and after
+they have been scanned.
+
+Field names are built fresh for every query, the way they arrive from a parsed query stream, so the numbers include
+whatever the database does, or does not do, to share them between records.
+"""
+
+import random
+import tracemalloc
+
+from in_memory_db import InMemoryDB
+
+KEYS = 10_000
+FIELDS_PER_KEY = [4, 32]
+SCENARIOS = [
+    # (name, share of fields set with a ttl, scan every record afterwards)
+    ("no ttl", 0.0, False),
+    ("half ttl", 0.5, False),
+    ("all ttl", 1.0, False),
+    ("no ttl, scanned", 0.0, True),
+]
+
+
+def build(fields_per_key: int, ttl_share: float, scanned: bool) -> InMemoryDB:
+    rng = random.Random(42)
+    db = InMemoryDB()
+    ts = 0
+    for i in range(KEYS):
+        key = f"key{i}"
+        for j in range(fields_per_key):
+            ts += 1
+            field = "".join(["field", str(j)])
+            if rng.random() < ttl_share:
+                db.set_with_ttl(ts, key, field, rng.randint(0, 10**6), 10**9)
+            else:
+                db.set(ts, key, field, rng.randint(0, 10**6))
+    if scanned:
+        for i in range(KEYS):
+            ts += 1
+            db.scan(ts, f"key{i}")
+
+    return db
+
+
+def bytes_per_field(fields_per_key: int, ttl_share: float, scanned: bool) -> float:
+    tracemalloc.start()
+    db = build(fields_per_key, ttl_share, scanned)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del db
+
+    return size / (KEYS * fields_per_key)
+
+
+def main() -> None:
+    print(f"{'scenario':>16} {'fields/key':>11} {'bytes/field':>12}")
+    for fields_per_key in FIELDS_PER_KEY:
+        for name, ttl_share, scanned in SCENARIOS:
+            print(f"{name:>16} {fields_per_key:>11} {bytes_per_field(fields_per_key, ttl_share, scanned):>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
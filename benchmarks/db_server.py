@@ -0,0 +1,89 @@
+"""
+Load generator for DBServer. Runs a server and its clients on one event loop and sweeps the number of concurrent
+clients and the pipeline depth (queries sent together per request), reporting throughput and per-query latency
+percentiles.
+
+Clients draw timestamps from one shared clock, so queries reach the server nearly but not necessarily in timestamp
+order; requests the server rejected for an out-of-order timestamp are counted. Raise REORDER_DELAY to trade latency
+for fewer rejections.
+"""
+
+import asyncio
+import random
+from itertools import count
+from time import perf_counter, perf_counter_ns
+
+from benchmarks.run import percentile
+from benchmarks.workloads import Operation
+from db_server import DBClient, DBServer, ServerError
+
+QUERIES = 20_000
+CONCURRENCY = [1, 4, 16, 64]
+DEPTHS = [1, 16]
+REORDER_DELAY = 0.0
+KEYS = [f"key{i}" for i in range(1_000)]
+FIELDS = [f"field{i}" for i in range(20)]
+
+
+async def client_worker(
+    client: DBClient, clock: "count[int]", rng: random.Random, queries: int, depth: int, latencies: list[int]
+) -> int:
+    rejected = 0
+    for _ in range(0, queries, depth):
+        batch: list[Operation] = []
+        for _ in range(depth):
+            key, field = rng.choice(KEYS), rng.choice(FIELDS)
+            if rng.random() < 0.2:
+                batch.append(("SET", (next(clock), key, field, rng.randint(0, 100))))
+            else:
+                batch.append(("GET", (next(clock), key, field)))
+
+        start = perf_counter_ns()
+        try:
+            await client.execute_many(batch)
+        except ServerError:
+            rejected += 1
+        latencies.extend([perf_counter_ns() - start] * depth)
+
+    return rejected
+
+
+async def run_level(concurrency: int, depth: int) -> tuple[float, list[int], int]:
+    server = await DBServer(reorder_delay=REORDER_DELAY).start(port=0)
+    port = server.sockets[0].getsockname()[1]
+    clock = count(1)
+    latencies: list[int] = []
+    async with server, DBClient(port=port, pool_size=min(concurrency, 8)) as client:
+        start = perf_counter()
+        rejected = await asyncio.gather(
+            *(
+                client_worker(client, clock, random.Random(i), QUERIES // concurrency, depth, latencies)
+                for i in range(concurrency)
+            )
+        )
+        elapsed = perf_counter() - start
+
+    return elapsed, sorted(latencies), sum(rejected)
+
+
+async def sweep() -> None:
+    print(
+        f"{'clients':>8} {'depth':>6} {'queries/sec':>12} {'p50 (us)':>10} {'p99 (us)':>10} {'p99.9 (us)':>11} "
+        f"{'rejected':>9}"
+    )
+    for depth in DEPTHS:
+        for concurrency in CONCURRENCY:
+            elapsed, latencies, rejected = await run_level(concurrency, depth)
+            print(
+                f"{concurrency:>8} {depth:>6} {len(latencies) / elapsed:>12,.0f} "
+                f"{percentile(latencies, 50) / 1000:>10.0f} {percentile(latencies, 99) / 1000:>10.0f} "
+                f"{percentile(latencies, 99.9) / 1000:>11.0f} {rejected:>9}"
+            )
+
+
+def main() -> None:
+    asyncio.run(sweep())
+
+
+if __name__ == "__main__":
+    main()
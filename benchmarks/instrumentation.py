@@ -0,0 +1,39 @@
+"""
+Measures what instrumentation costs: every workload is run on a plain instance, an instrumented one and one that was
+instrumented and then uninstrumented, and the throughput of the three is compared.
+"""
+
+from time import perf_counter
+
+from benchmarks.workloads import WORKLOADS, Operation, Workload
+from instrumentation import instrument, uninstrument
+
+SIZE = 100_000
+
+
+def run(workload: Workload, ops: list[Operation], mode: str) -> float:
+    system = workload.factory()
+    if mode != "plain":
+        instrument(system)
+    if mode == "disabled":
+        uninstrument(system)
+
+    methods = {op: getattr(system, method_name) for op, (method_name, _) in workload.commands.items()}
+    start = perf_counter()
+    for op, args in ops:
+        methods[op](*args)
+    return perf_counter() - start
+
+
+def main() -> None:
+    print(f"{'workload':>24} {'mode':>14} {'ops/sec':>12} {'overhead':>9}")
+    for name, workload in WORKLOADS.items():
+        ops = list(workload.generate(SIZE, 42))
+        plain = run(workload, ops, "plain")
+        for mode in ["plain", "instrumented", "disabled"]:
+            elapsed = plain if mode == "plain" else run(workload, ops, mode)
+            print(f"{name:>24} {mode:>14} {len(ops) / elapsed:>12,.0f} {elapsed / plain - 1:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Runs the synthetic workloads across a sweep of sizes and reports throughput, p50/p99 latency and peak memory per
+operation type.
+
+    python -m benchmarks.run --workload bank-payments --sizes 1000,10000 --output results.json
+
+Every run is timed in one pass and then replayed under tracemalloc for memory, so tracing does not skew latencies.
+Results are written as JSON so runs can be compared against each other.
+"""
+
+import argparse
+import json
+import platform
+import tracemalloc
+from time import perf_counter_ns
+from typing import Any
+
+from benchmarks.workloads import WORKLOADS, Operation, Workload
+
+SIZES = [10**3, 10**4, 10**5, 10**6]
+DEFAULT_SEED = 42
+
+
+def percentile(sorted_values: list[int], pct: float) -> int:
+    idx = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[idx]
+
+
+def time_operations(workload: Workload, ops: list[Operation]) -> tuple[int, dict[str, list[int]]]:
+    system = workload.factory()
+    methods = {op: getattr(system, method_name) for op, (method_name, _) in workload.commands.items()}
+    latencies: dict[str, list[int]] = {}
+
+    run_start = perf_counter_ns()
+    for op, args in ops:
+        method = methods[op]
+        start = perf_counter_ns()
+        method(*args)
+        latencies.setdefault(op, []).append(perf_counter_ns() - start)
+
+    return perf_counter_ns() - run_start, latencies
+
+
+def trace_memory(workload: Workload, ops: list[Operation]) -> tuple[int, dict[str, int]]:
+    tracemalloc.start()
+    try:
+        system = workload.factory()
+        methods = {op: getattr(system, method_name) for op, (method_name, _) in workload.commands.items()}
+        op_peaks: dict[str, int] = {}
+        run_peak = 0
+        for op, args in ops:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            methods[op](*args)
+            _, peak = tracemalloc.get_traced_memory()
+            op_peaks[op] = max(op_peaks.get(op, 0), peak - before)
+            run_peak = max(run_peak, peak)
+    finally:
+        tracemalloc.stop()
+
+    return run_peak, op_peaks
+
+
+def run_workload(name: str, size: int, seed: int, trace: bool = True) -> dict[str, Any]:
+    workload = WORKLOADS[name]
+    ops = list(workload.generate(size, seed))
+    elapsed_ns, latencies = time_operations(workload, ops)
+    run_peak, op_peaks = trace_memory(workload, ops) if trace else (None, {})
+
+    operations: dict[str, Any] = {}
+    for op, values in sorted(latencies.items()):
+        values.sort()
+        total_ns = sum(values)
+        operations[op] = {
+            "count": len(values),
+            "ops_per_sec": len(values) / total_ns * 1e9 if total_ns else None,
+            "mean_us": total_ns / len(values) / 1000,
+            "p50_us": percentile(values, 50) / 1000,
+            "p99_us": percentile(values, 99) / 1000,
+            "max_us": values[-1] / 1000,
+            "peak_memory_bytes": op_peaks.get(op),
+        }
+
+    return {
+        "workload": name,
+        "size": size,
+        "seed": seed,
+        "operations_run": len(ops),
+        "elapsed_s": elapsed_ns / 1e9,
+        "ops_per_sec": len(ops) / elapsed_ns * 1e9 if elapsed_ns else None,
+        "peak_memory_bytes": run_peak,
+        "operations": operations,
+    }
+
+
+def print_result(result: dict[str, Any]) -> None:
+    print(
+        f"{result['workload']} size={result['size']}: {result['ops_per_sec']:,.0f} ops/sec"
+        + (f", peak {result['peak_memory_bytes'] / 2**20:.1f} MiB" if result["peak_memory_bytes"] is not None else "")
+    )
+    for op, s in result["operations"].items():
+        peak = f"{s['peak_memory_bytes']:>12}" if s["peak_memory_bytes"] is not None else f"{'-':>12}"
+        print(f"  {op:<26} {s['count']:>9} p50 {s['p50_us']:>10.2f}us p99 {s['p99_us']:>10.2f}us peak {peak}B")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the synthetic workload benchmarks.")
+    parser.add_argument(
+        "--workload", action="append", choices=sorted(WORKLOADS), help="workload to run, repeatable (default: all)"
+    )
+    parser.add_argument(
+        "--sizes", default=",".join(str(s) for s in SIZES), help="comma separated operation counts to sweep"
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.workload or sorted(WORKLOADS):
+        for size in (int(s) for s in args.sizes.split(",")):
+            result = run_workload(name, size, args.seed, trace=not args.no_memory)
+            print_result(result)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
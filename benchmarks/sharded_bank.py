@@ -0,0 +1,46 @@
+"""
+Compares ShardedBank against a single Bank on the same streams, for a range of shard counts, and checks that both
+return the same results.
+"""
+
+import os
+from time import perf_counter
+from typing import Any
+
+from banking_system import QUERY_COMMANDS, Bank
+from benchmarks.workloads import Operation, bank_merges, bank_payments
+from sharded_bank import ShardedBank
+
+SIZE = 100_000
+# the 1-shard row is the single Bank
+SHARDS = sorted(n for n in {2, 4, os.cpu_count() or 1} if n > 1)
+
+
+def run_single(ops: list[Operation]) -> tuple[list[Any], float]:
+    bank = Bank()
+    start = perf_counter()
+    results = [getattr(bank, QUERY_COMMANDS[op][0])(*args) for op, args in ops]
+    return results, perf_counter() - start
+
+
+def run_sharded(ops: list[Operation], num_shards: int) -> tuple[list[Any], float]:
+    with ShardedBank(num_shards) as bank:
+        start = perf_counter()
+        results = list(bank.run(ops))
+        return results, perf_counter() - start
+
+
+def main() -> None:
+    print(f"{'stream':>14} {'shards':>7} {'elapsed (s)':>12} {'ops/sec':>12} {'speedup':>8}")
+    for name, generate in [("bank-payments", bank_payments), ("bank-merges", bank_merges)]:
+        ops = list(generate(SIZE, seed=42))
+        expected, single = run_single(ops)
+        print(f"{name:>14} {1:>7} {single:>12.3f} {len(ops) / single:>12,.0f} {1:>7.2f}x")
+        for num_shards in SHARDS:
+            results, elapsed = run_sharded(ops, num_shards)
+            assert results == expected
+            print(f"{name:>14} {num_shards:>7} {elapsed:>12.3f} {len(ops) / elapsed:>12,.0f} {single / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
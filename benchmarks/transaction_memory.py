@@ -0,0 +1,73 @@
+"""
+Compares the memory held by an account's transaction history in the columnar TransactionLog against the previous
+layout of one Transaction object per row in a SortedList keyed on ts.
+"""
+
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+from sortedcontainers import SortedList
+
+from banking_system import Transaction, TransactionLog, TransactionType
+
+SIZES = [10_000, 100_000, 1_000_000]
+TYPES = list(TransactionType)
+
+
+class DictTransaction:
+    """Transaction as it was stored before, with a per-instance __dict__."""
+
+    def __init__(self, ts: int, type: TransactionType, amount: int) -> None:
+        self.type = type
+        self.amount = amount
+        self.ts = ts
+
+
+def build_object_history(size: int) -> SortedList:
+    history = SortedList(key=lambda x: x.ts)
+    for i in range(size):
+        history.add(DictTransaction(i, TYPES[i % len(TYPES)], i * 7))
+
+    return history
+
+
+def build_slotted_object_history(size: int) -> SortedList:
+    history = SortedList(key=lambda x: x.ts)
+    for i in range(size):
+        history.add(Transaction(i, TYPES[i % len(TYPES)], i * 7))
+
+    return history
+
+
+def build_columnar_history(size: int) -> TransactionLog:
+    history = TransactionLog()
+    for i in range(size):
+        history.append(i, TYPES[i % len(TYPES)], i * 7)
+
+    return history
+
+
+def measure(build: Callable[[int], Any], size: int) -> int:
+    tracemalloc.start()
+    history = build(size)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del history
+    return current
+
+
+def main() -> None:
+    layouts = [
+        ("objects", build_object_history),
+        ("slotted objects", build_slotted_object_history),
+        ("columnar", build_columnar_history),
+    ]
+    print(f"{'rows':>10} " + " ".join(f"{name + ' (B/row)':>22}" for name, _ in layouts))
+    for size in SIZES:
+        per_row = [measure(build, size) / size for _, build in layouts]
+        print(f"{size:>10} " + " ".join(f"{b:>22.1f}" for b in per_row))
+
+
+if __name__ == "__main__":
+    main()
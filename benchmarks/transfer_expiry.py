@@ -0,0 +1,53 @@
+"""
+Measures Bank._expire_transfers against the number of pending transfers.
+
+With the expiry queue, a call that expires nothing should cost the same regardless of how many transfers are pending,
+and a call that expires k transfers should cost O(k).
+"""
+
+from time import perf_counter
+
+from banking_system import Bank
+
+PENDING_SIZES = [1_000, 10_000, 100_000]
+CALLS = 10_000
+
+
+def build_bank(pending: int) -> Bank:
+    bank = Bank()
+    bank.create_account("1", "source")
+    bank.create_account("2", "target")
+    bank.deposit("3", "source", pending)
+    for i in range(pending):
+        bank.transfer(str(10 + i), "source", "target", 1)
+
+    return bank
+
+
+def time_idle_calls(bank: Bank, ts: int) -> float:
+    start = perf_counter()
+    for i in range(CALLS):
+        bank._expire_transfers(ts + i)
+
+    return (perf_counter() - start) / CALLS
+
+
+def time_full_expiry(bank: Bank) -> float:
+    start = perf_counter()
+    bank._expire_transfers(10**12)
+    return perf_counter() - start
+
+
+def main() -> None:
+    print(f"{'pending':>10} {'idle call (us)':>16} {'expire all (ms)':>16} {'per expired (us)':>17}")
+    for pending in PENDING_SIZES:
+        bank = build_bank(pending)
+        idle = time_idle_calls(bank, 10 + pending)
+        full = time_full_expiry(bank)
+        assert not bank.pending_transfers
+
+        print(f"{pending:>10} {idle * 1e6:>16.3f} {full * 1e3:>16.3f} {full / pending * 1e6:>17.3f}")
+
+
+if __name__ == "__main__":
+    main()
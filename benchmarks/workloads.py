@@ -0,0 +1,246 @@
+"""
+Seeded synthetic workload generators.
+
+Each generator yields (operation, args) pairs in the vocabulary of the target module's QUERY_COMMANDS, with
+arguments already converted, in strictly increasing timestamp order. The same (size, seed) always produces the same
+stream, so runs can be compared against each other. size is the number of operations generated; the number of
+accounts, keys and users scales with it.
+"""
+
+import random
+from collections.abc import Callable, Iterator
+from typing import Any
+
+import banking_system
+import cloud_storage
+import in_memory_db
+from query_runner import Command
+
+Operation = tuple[str, tuple[Any, ...]]
+
+DAY = banking_system.MILLISECONDS_IN_1_DAY
+
+
+class Clock:
+    """Strictly increasing timestamps whose steps spread size operations over roughly span milliseconds."""
+
+    def __init__(self, rng: random.Random, size: int, span: int) -> None:
+        self.rng = rng
+        self.max_step = max(2, 2 * span // max(size, 1))
+        self.ts = 0
+
+    def tick(self) -> int:
+        self.ts += self.rng.randint(1, self.max_step)
+        return self.ts
+
+
+def bank_payments(size: int, seed: int) -> Iterator[Operation]:
+    rng = random.Random(seed)
+    clock = Clock(rng, size, 3 * DAY)
+    accounts = [f"account{i}" for i in range(max(10, size // 20))]
+    for account_id in accounts:
+        yield "CREATE_ACCOUNT", (clock.tick(), account_id)
+        yield "DEPOSIT", (clock.tick(), account_id, rng.randint(1_000, 100_000))
+
+    payments = 0
+    for _ in range(size - 2 * len(accounts)):
+        account_id = rng.choice(accounts)
+        r = rng.random()
+        if r < 0.3:
+            payments += 1
+            yield "PAY", (clock.tick(), account_id, rng.randint(1, 500))
+        elif r < 0.5:
+            payments += 1
+            yield "SCHEDULE_PAYMENT", (clock.tick(), account_id, rng.randint(1, 500), rng.randint(1, DAY))
+        elif r < 0.6:
+            yield "CANCEL_PAYMENT", (clock.tick(), account_id, f"payment{rng.randint(1, payments + 1)}")
+        elif r < 0.75:
+            yield "DEPOSIT", (clock.tick(), account_id, rng.randint(1, 1_000))
+        elif r < 0.85:
+            yield "GET_PAYMENT_STATUS", (clock.tick(), account_id, f"payment{rng.randint(1, payments + 1)}")
+        elif r < 0.95:
+            yield "TOP_SPENDERS", (clock.tick(), rng.randint(1, 10))
+        else:
+            yield "TOP_ACTIVITY", (clock.tick(), rng.randint(1, 10))
+
+
+def bank_merges(size: int, seed: int) -> Iterator[Operation]:
+    rng = random.Random(seed)
+    clock = Clock(rng, size, 3 * DAY)
+    live = [f"account{i}" for i in range(max(10, size // 10))]
+    created = len(live)
+    for account_id in live:
+        yield "CREATE_ACCOUNT", (clock.tick(), account_id)
+        yield "DEPOSIT", (clock.tick(), account_id, rng.randint(1_000, 100_000))
+
+    transfers = 0
+    for _ in range(size - 2 * created):
+        r = rng.random()
+        if r < 0.1 and len(live) > 2:
+            first, second = rng.sample(live, 2)
+            live.remove(second)
+            yield "MERGE_ACCOUNTS", (clock.tick(), first, second)
+        elif r < 0.2:
+            account_id = f"account{created}"
+            created += 1
+            live.append(account_id)
+            yield "CREATE_ACCOUNT", (clock.tick(), account_id)
+        elif r < 0.4:
+            yield "PAY", (clock.tick(), rng.choice(live), rng.randint(1, 500))
+        elif r < 0.55:
+            transfers += 1
+            yield "TRANSFER", (clock.tick(), rng.choice(live), rng.choice(live), rng.randint(1, 500))
+        elif r < 0.65:
+            yield "ACCEPT_TRANSFER", (clock.tick(), rng.choice(live), f"transfer{rng.randint(1, transfers + 1)}")
+        elif r < 0.85:
+            ts = clock.tick()
+            yield "GET_BALANCE", (ts, rng.choice(live), rng.randint(1, ts))
+        else:
+            yield "DEPOSIT", (clock.tick(), rng.choice(live), rng.randint(1, 1_000))
+
+
+def db_ttl(size: int, seed: int) -> Iterator[Operation]:
+    rng = random.Random(seed)
+    clock = Clock(rng, size, size * 10)
+    keys = [f"key{i}" for i in range(max(10, size // 100))]
+    fields = [f"field{i}" for i in range(50)]
+    for _ in range(size):
+        key, field = rng.choice(keys), rng.choice(fields)
+        r = rng.random()
+        if r < 0.45:
+            yield "SET_WITH_TTL", (clock.tick(), key, field, rng.randint(0, 100), rng.randint(1, 1_000))
+        elif r < 0.55:
+            yield "SET", (clock.tick(), key, field, rng.randint(0, 100))
+        elif r < 0.65:
+            yield (
+                "COMPARE_AND_SET_WITH_TTL",
+                (
+                    clock.tick(),
+                    key,
+                    field,
+                    rng.randint(0, 100),
+                    rng.randint(0, 100),
+                    rng.randint(1, 1_000),
+                ),
+            )
+        elif r < 0.95:
+            yield "GET", (clock.tick(), key, field)
+        else:
+            yield "SCAN", (clock.tick(), key)
+
+
+def db_prefix_scan(size: int, seed: int) -> Iterator[Operation]:
+    rng = random.Random(seed)
+    clock = Clock(rng, size, size * 10)
+    keys = [f"key{i}" for i in range(max(1, size // 10_000))]
+    for _ in range(size):
+        key = rng.choice(keys)
+        field = f"{rng.choice('abcdefgh')}{rng.randint(0, size)}"
+        r = rng.random()
+        if r < 0.6:
+            yield "SET", (clock.tick(), key, field, rng.randint(0, 100))
+        elif r < 0.7:
+            yield "SET_WITH_TTL", (clock.tick(), key, field, rng.randint(0, 100), rng.randint(1, 10_000))
+        elif r < 0.98:
+            yield "SCAN_BY_PREFIX", (clock.tick(), key, field[: rng.randint(2, 4)])
+        else:
+            yield "SCAN", (clock.tick(), key)
+
+
+def db_backup_restore(size: int, seed: int) -> Iterator[Operation]:
+    rng = random.Random(seed)
+    clock = Clock(rng, size, size * 10)
+    keys = [f"key{i}" for i in range(max(10, size // 20))]
+    backups: list[int] = []
+    for _ in range(size):
+        key, field = rng.choice(keys), f"field{rng.randint(0, 20)}"
+        r = rng.random()
+        if r < 0.4:
+            yield "SET", (clock.tick(), key, field, rng.randint(0, 100))
+        elif r < 0.6:
+            yield "SET_WITH_TTL", (clock.tick(), key, field, rng.randint(0, 100), rng.randint(1, 100_000))
+        elif r < 0.996:
+            yield "GET", (clock.tick(), key, field)
+        elif r < 0.998 and backups:
+            yield "RESTORE", (clock.tick(), rng.choice(backups))
+        else:
+            ts = clock.tick()
+            backups.append(ts)
+            yield "BACKUP", (ts,)
+
+
+def storage_prefix_scan(size: int, seed: int) -> Iterator[Operation]:
+    rng = random.Random(seed)
+    users = [f"user{i}" for i in range(max(1, size // 1_000))]
+    for user_id in users:
+        yield "ADD_USER", (user_id, 10**12)
+
+    files: list[str] = []
+    for i in range(size - len(users)):
+        r = rng.random()
+        if r < 0.6 or not files:
+            name = f"/{rng.choice('abcd')}/{rng.choice('efgh')}/file{i}"
+            files.append(name)
+            yield "ADD_FILE_BY", (rng.choice(users), name, rng.randint(1, 10_000))
+        elif r < 0.7:
+            yield "DELETE_FILE", (files.pop(rng.randrange(len(files))),)
+        elif r < 0.8:
+            yield "GET_FILE_SIZE", (rng.choice(files),)
+        else:
+            yield "GET_N_LARGEST", (rng.choice(["/", "/a", "/a/e", "/b/f/file1"]), rng.randint(1, 10))
+
+
+def storage_backup_restore(size: int, seed: int) -> Iterator[Operation]:
+    rng = random.Random(seed)
+    users = [f"user{i}" for i in range(max(2, size // 1_000))]
+    for user_id in users:
+        yield "ADD_USER", (user_id, 10**12)
+
+    files: list[str] = []
+    created = len(users)
+    for i in range(size - len(users)):
+        r = rng.random()
+        if r < 0.6 or not files:
+            name = f"file{i}"
+            files.append(name)
+            yield "ADD_FILE_BY", (rng.choice(users), name, rng.randint(1, 10_000))
+        elif r < 0.7:
+            yield "DELETE_FILE", (files.pop(rng.randrange(len(files))),)
+        elif r < 0.8:
+            yield "BACKUP_USER", (rng.choice(users),)
+        elif r < 0.9:
+            yield "RESTORE_USER", (rng.choice(users),)
+        elif r < 0.99 or len(users) < 3:
+            yield "GET_FILE_SIZE", (rng.choice(files),)
+        else:
+            first, second = rng.sample(users, 2)
+            users.remove(second)
+            yield "MERGE_USER", (first, second)
+            users.append(f"user{created}")
+            created += 1
+            yield "ADD_USER", (users[-1], 10**12)
+
+
+class Workload:
+    def __init__(
+        self,
+        factory: Callable[[], object],
+        commands: dict[str, Command],
+        generate: Callable[[int, int], Iterator[Operation]],
+    ) -> None:
+        self.factory = factory
+        self.commands = commands
+        self.generate = generate
+
+
+WORKLOADS: dict[str, Workload] = {
+    "bank-payments": Workload(banking_system.Bank, banking_system.QUERY_COMMANDS, bank_payments),
+    "bank-merges": Workload(banking_system.Bank, banking_system.QUERY_COMMANDS, bank_merges),
+    "db-ttl": Workload(in_memory_db.InMemoryDB, in_memory_db.QUERY_COMMANDS, db_ttl),
+    "db-prefix-scan": Workload(in_memory_db.InMemoryDB, in_memory_db.QUERY_COMMANDS, db_prefix_scan),
+    "db-backup-restore": Workload(in_memory_db.InMemoryDB, in_memory_db.QUERY_COMMANDS, db_backup_restore),
+    "storage-prefix-scan": Workload(cloud_storage.CloudStorage, cloud_storage.QUERY_COMMANDS, storage_prefix_scan),
+    "storage-backup-restore": Workload(
+        cloud_storage.CloudStorage, cloud_storage.QUERY_COMMANDS, storage_backup_restore
+    ),
+}
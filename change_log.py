@@ -0,0 +1,121 @@
+"""
+Change-data-capture for Bank, InMemoryDB and CloudStorage.
+
+A system given a ChangeLog appends one Change to it for every change to its state, so consumers such as search
+indexes or replicas can apply deltas instead of re-reading the whole state:
+
+    changes = ChangeLog()
+    bank = Bank(changes=changes)
+    ...
+    for change in changes.read(position):
+        apply(change)
+        position = change.seq + 1
+
+The log is a ring buffer of the latest capacity changes. Every change gets the next sequence number, so a consumer
+resumes from the number after the last change it applied. Reading from a position that has already been overwritten
+raises ValueError; the consumer has fallen too far behind and has to rescan the system's state.
+"""
+
+from collections.abc import Iterator
+from typing import Any
+
+DEFAULT_CHANGE_LOG_CAPACITY = 1 << 16
+
+# kind -> names of Change.values. key is the account, record or file the change is to.
+CHANGE_KINDS: dict[str, tuple[str, ...]] = {
+    # Bank
+    "account_created": (),
+    "deposit": ("amount", "balance"),
+    "payment": ("payment_id", "amount", "balance"),
+    "payment_scheduled": ("payment_id", "amount", "due"),
+    "payment_cancelled": ("payment_id",),
+    "payment_performed": ("payment_id", "amount", "balance"),
+    "payment_declined": ("payment_id", "amount"),
+    "cashback": ("payment_id", "amount", "balance"),
+    "transfer_held": ("transfer_id", "target", "amount"),
+    "transfer_expired": ("transfer_id", "amount"),
+    "transfer_out": ("transfer_id", "amount", "balance"),
+    "transfer_in": ("transfer_id", "amount", "balance"),
+    "accounts_merged": ("merged_account_id", "balance"),
+    # InMemoryDB
+    "field_set": ("field", "value", "ttl"),
+    "field_deleted": ("field",),
+    "field_expired": ("field",),
+    # every record may have changed; key is empty
+    "restored": ("timestamp_to_restore",),
+    # CloudStorage
+    "user_added": ("capacity",),
+    "file_added": ("size", "owner"),
+    "file_deleted": ("size",),
+    "users_merged": ("merged_user_id", "capacity"),
+}
+
+
+class Change:
+    """
+    One change, seq-th in its ChangeLog. ts is the timestamp it happened at, or None for CloudStorage, which has no
+    clock.
+    """
+
+    __slots__ = ("seq", "ts", "kind", "key", "values")
+
+    def __init__(self, seq: int, ts: int | None, kind: str, key: str, values: tuple[Any, ...]) -> None:
+        self.seq = seq
+        self.ts = ts
+        self.kind = kind
+        self.key = key
+        self.values = values
+
+    def __repr__(self) -> str:
+        return f"Change({self.seq}, {self.ts}, {self.kind!r}, {self.key!r}, {self.values!r})"
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "seq": self.seq,
+            "ts": self.ts,
+            "kind": self.kind,
+            "key": self.key,
+            **dict(zip(CHANGE_KINDS[self.kind], self.values, strict=True)),
+        }
+
+
+class ChangeLog:
+    """Ring buffer of the latest capacity changes. oldest and next_seq bound the sequence numbers it still holds."""
+
+    def __init__(self, capacity: int = DEFAULT_CHANGE_LOG_CAPACITY) -> None:
+        if capacity <= 0:
+            raise ValueError("Capacity must be positive")
+
+        self.capacity = capacity
+        self._buffer: list[Change | None] = [None] * capacity
+        self.next_seq = 0
+
+    def __len__(self) -> int:
+        return min(self.next_seq, self.capacity)
+
+    @property
+    def oldest(self) -> int:
+        return self.next_seq - len(self)
+
+    def append(self, ts: int | None, kind: str, key: str, *values: Any) -> None:
+        self._buffer[self.next_seq % self.capacity] = Change(self.next_seq, ts, kind, key, values)
+        self.next_seq += 1
+
+    def read(self, start: int | None = None) -> Iterator[Change]:
+        """
+        Yields the changes from sequence number start, by default the oldest held, up to the latest one, including
+        changes appended while the generator is being consumed.
+        """
+        seq = self.oldest if start is None else start
+        if seq > self.next_seq:
+            raise ValueError(f"No change {seq} yet; the next change is {self.next_seq}")
+
+        while seq < self.next_seq:
+            # checked on every step, since the producer may run between two of them
+            if seq < self.oldest:
+                raise ValueError(f"Change {seq} has been overwritten; the oldest change held is {self.oldest}")
+
+            change = self._buffer[seq % self.capacity]
+            assert change is not None
+            yield change
+            seq += 1
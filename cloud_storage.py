@@ -50,35 +50,170 @@ Note that the RESTORE_USER operation does not affect the user's capacity. Badly
 increased back when restore deleted all user's files. It actually means the initial capacity not changed.
 """
 
+import heapq
+from itertools import takewhile
+
+from sortedcontainers import SortedList
+
+from change_log import ChangeLog
+from query_runner import Command, run_cli
+
 
 class User:
-    def __init__(self, user_id: str, capacity: int):
+    def __init__(self, user_id: str, capacity: int, uid: int = 0):
         self.user_id = user_id
+        # Ownership node of this user in CloudStorage.owners. Files added by or restored to this user point at it.
+        self.uid = uid
 
         if capacity < 0 and user_id != "admin":
             raise ValueError("Capacity must be nonnegative")
         self.max_capacity = capacity
         self.curr_capacity = capacity
+        # Files whose owner node is this user's; files of users merged into this one stay in their own sets.
         self.files: set[str] = set()
         self.backup: dict[str, File] = {}
+        # This user and every user merged into it.
+        self.members: list[User] = [self]
+
+        # Changes since the last backup (or since the user was added): names added to or removed from this user,
+        # and merged users none of whose files are in the backup yet.
+        self.changed_files: set[str] = set()
+        self.unbacked_members: list[User] = []
 
 
 class File:
-    def __init__(self, name: str, size_bytes: int, user_id: str) -> None:
+    def __init__(self, name: str, size_bytes: int, owner: int) -> None:
         self.name = name
         self.size_bytes = size_bytes
-        self.user_id = user_id
+        # Ownership node the file was stored under; CloudStorage.owners resolves it to the current owner.
+        self.owner = owner
 
 
-class CloudStorage:
+class DisjointSet:
+    """Union-find over ownership nodes 0..n-1 with path compression and union by size."""
+
+    def __init__(self) -> None:
+        self.parent: list[int] = []
+        self.size: list[int] = []
+
+    def make(self) -> int:
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, node: int) -> int:
+        root = node
+        while self.parent[root] != root:
+            root = self.parent[root]
+
+        while self.parent[node] != root:
+            self.parent[node], node = root, self.parent[node]
+
+        return root
+
+    def union(self, a: int, b: int) -> int:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return root_a
+
+
+# Prefixes up to this length keep their own size-ordered index. Longer prefixes match few enough names that their
+# range of the sorted name list is scanned instead.
+INDEXED_PREFIX_LENGTH = 4
+
+
+class FileCatalog:
+    """Stored file names, in lexicographic order and, for every short prefix, by size descending then name."""
+
     def __init__(self) -> None:
+        self.names: SortedList = SortedList()
+        self.by_prefix: dict[str, SortedList] = {}
+
+    def add(self, f: File) -> None:
+        self.names.add(f.name)
+        for k in range(min(len(f.name), INDEXED_PREFIX_LENGTH) + 1):
+            prefix = f.name[:k]
+            if prefix not in self.by_prefix:
+                self.by_prefix[prefix] = SortedList()
+            self.by_prefix[prefix].add((-f.size_bytes, f.name))
+
+    def remove(self, f: File) -> None:
+        self.names.remove(f.name)
+        for k in range(min(len(f.name), INDEXED_PREFIX_LENGTH) + 1):
+            prefix = f.name[:k]
+            self.by_prefix[prefix].remove((-f.size_bytes, f.name))
+            if not self.by_prefix[prefix]:
+                del self.by_prefix[prefix]
+
+    def largest(self, prefix: str, n: int, storage: dict[str, File]) -> list[File]:
+        if len(prefix) <= INDEXED_PREFIX_LENGTH:
+            by_size = self.by_prefix.get(prefix)
+            if by_size is None:
+                return []
+
+            return [storage[name] for _, name in by_size.islice(0, n)]
+
+        matching_names = takewhile(lambda name: name.startswith(prefix), self.names.irange(minimum=prefix))
+        matching = (storage[name] for name in matching_names)
+        if n < 0:
+            # counts from the end, as slicing the full ranking does
+            return sorted(matching, key=lambda x: (-x.size_bytes, x.name))[:n]
+
+        return heapq.nsmallest(n, matching, key=lambda x: (-x.size_bytes, x.name))
+
+
+class CloudStorage:
+    """
+    With changes set, every user added or merged and every file stored or removed, including by restore_user, is
+    also appended to that ChangeLog.
+    """
+
+    def __init__(self, changes: ChangeLog | None = None) -> None:
         self.storage: dict[str, File] = {}
+        self.catalog = FileCatalog()
         self.users: dict[str, User] = {}
-        self.users["admin"] = User("admin", -1)
+
+        # Every user ever added is an ownership node; merging users unions their nodes, so a file's owner is the
+        # live user mapped from the root of its node.
+        self.owners = DisjointSet()
+        self.nodes: list[User] = []
+        self.root_users: dict[int, User] = {}
+        self.changes = changes
+        self._add_user("admin", -1)
 
     def _is_admin_user(self, user_id: str) -> bool:
         return user_id == "admin"
 
+    def _add_user(self, user_id: str, capacity: int) -> User:
+        user = User(user_id, capacity, self.owners.make())
+        self.users[user_id] = user
+        self.nodes.append(user)
+        self.root_users[user.uid] = user
+        return user
+
+    def _owner(self, f: File) -> User:
+        return self.root_users[self.owners.find(f.owner)]
+
+    def _store(self, f: File) -> None:
+        if f.name in self.storage:
+            self.catalog.remove(self.storage[f.name])
+        self.storage[f.name] = f
+        self.catalog.add(f)
+        if self.changes is not None:
+            self.changes.append(None, "file_added", f.name, f.size_bytes, self._owner(f).user_id)
+
+    def _unstore(self, name: str) -> None:
+        f = self.storage.pop(name)
+        self.catalog.remove(f)
+        if self.changes is not None:
+            self.changes.append(None, "file_deleted", name, f.size_bytes)
+
     def add_file(self, name: str, size: int) -> bool:
         res = self.add_file_by("admin", name, size)
         return True if res else False
@@ -96,18 +231,16 @@ class CloudStorage:
 
         f = self.storage[name]
         res = self.get_file_size(name)
-        if f.user_id in self.users:
-            user = self.users[f.user_id]
-            user.curr_capacity += f.size_bytes
-            user.files.remove(name)
+        owner = self._owner(f)
+        owner.curr_capacity += f.size_bytes
+        owner.changed_files.add(name)
+        self.nodes[f.owner].files.remove(name)
 
-        del self.storage[name]
+        self._unstore(name)
         return res
 
     def get_n_largest(self, prefix: str, n: int) -> str:
-        matching_files = [f for f in self.storage.values() if f.name.startswith(prefix)]
-        files_by_size = sorted(matching_files, key=lambda x: (-x.size_bytes, x.name))
-        n_largest = files_by_size[:n]
+        n_largest = self.catalog.largest(prefix, n, self.storage)
 
         return ", ".join(f"{file.name}({file.size_bytes})" for file in n_largest)
 
@@ -115,7 +248,9 @@ class CloudStorage:
         if user_id in self.users:
             return False
 
-        self.users[user_id] = User(user_id, capacity)
+        self._add_user(user_id, capacity)
+        if self.changes is not None:
+            self.changes.append(None, "user_added", user_id, capacity)
         return True
 
     def add_file_by(self, user_id: str, name: str, size: int) -> str:
@@ -126,9 +261,10 @@ class CloudStorage:
         if not self._is_admin_user(user_id) and user.curr_capacity - size < 0:
             return ""
 
-        f = File(name, size, user_id)
+        f = File(name, size, user.uid)
         user.files.add(name)
-        self.storage[name] = f
+        user.changed_files.add(name)
+        self._store(f)
         user.curr_capacity -= size
 
         return str(user.curr_capacity)
@@ -142,44 +278,100 @@ class CloudStorage:
 
         user_1.max_capacity += user_2.max_capacity
         user_1.curr_capacity += user_2.curr_capacity
-        user_1.files.update(user_2.files)
-
-        for file_name in user_2.files:
-            self.storage[file_name].user_id = user_id_1
+        user_1.unbacked_members.extend(user_2.members)
+        if len(user_1.members) < len(user_2.members):
+            user_1.members, user_2.members = user_2.members, user_1.members
+        user_1.members.extend(user_2.members)
+        user_2.members = []
+        user_2.backup = {}
+        user_2.changed_files = set()
+        user_2.unbacked_members = []
+
+        del self.root_users[self.owners.find(user_1.uid)]
+        del self.root_users[self.owners.find(user_2.uid)]
+        self.root_users[self.owners.union(user_1.uid, user_2.uid)] = user_1
         del self.users[user_id_2]
+        if self.changes is not None:
+            self.changes.append(None, "users_merged", user_id_1, user_id_2, user_1.curr_capacity)
 
         return str(user_1.curr_capacity)
 
+    def _owns(self, user: User, file_name: str) -> bool:
+        return file_name in self.storage and self._owner(self.storage[file_name]) is user
+
+    def _changed_since_backup(self, user: User) -> set[str]:
+        changed = set(user.changed_files)
+        for member in user.unbacked_members:
+            changed.update(member.files)
+
+        return changed
+
     def backup_user(self, user_id: str) -> str:
         if user_id not in self.users:
             return ""
 
+        # Files not changed since the previous backup are already in it, so only the changes are applied.
         user = self.users[user_id]
-        backup: dict[str, File] = {}
-        for file_name in user.files:
-            f = self.storage[file_name]
-            backup[file_name] = File(f.name, f.size_bytes, f.user_id)
+        for file_name in self._changed_since_backup(user):
+            if self._owns(user, file_name):
+                f = self.storage[file_name]
+                user.backup[file_name] = File(f.name, f.size_bytes, user.uid)
+            else:
+                user.backup.pop(file_name, None)
 
-        user.backup = backup
-        return str(len(user.files))
+        user.changed_files = set()
+        user.unbacked_members = []
+        return str(len(user.backup))
 
     def restore_user(self, user_id: str) -> str:
         if user_id not in self.users:
             return ""
 
-        num_successful_restores = 0
+        # Files not changed since the backup already match it. Everything else is deleted, then re-added from the
+        # backup unless another user has taken the name in the meantime.
         user = self.users[user_id]
-        for file_name in list(user.files):
-            self.delete_file(file_name)
-
-        if user.backup:
-            for file_name, f in user.backup.items():
-                if (
-                    file_name in self.storage and self.storage[file_name].user_id == user_id
-                ) or file_name not in self.storage:
-                    user.files.add(file_name)
-                    self.storage[file_name] = f
-                    user.curr_capacity -= f.size_bytes
-                    num_successful_restores += 1
-
+        changed = self._changed_since_backup(user)
+        for file_name in changed:
+            if self._owns(user, file_name):
+                self.delete_file(file_name)
+
+        num_successful_restores = len(user.backup)
+        skipped: set[str] = set()
+        for file_name in changed:
+            if file_name not in user.backup:
+                continue
+
+            if file_name in self.storage:
+                num_successful_restores -= 1
+                skipped.add(file_name)
+                continue
+
+            f = user.backup[file_name]
+            user.files.add(file_name)
+            self._store(f)
+            user.curr_capacity -= f.size_bytes
+
+        user.changed_files = skipped
+        user.unbacked_members = []
         return str(num_successful_restores)
+
+
+QUERY_COMMANDS: dict[str, Command] = {
+    "ADD_FILE": ("add_file", (str, int)),
+    "GET_FILE_SIZE": ("get_file_size", (str,)),
+    "DELETE_FILE": ("delete_file", (str,)),
+    "GET_N_LARGEST": ("get_n_largest", (str, int)),
+    "ADD_USER": ("add_user", (str, int)),
+    "ADD_FILE_BY": ("add_file_by", (str, str, int)),
+    "MERGE_USER": ("merge_user", (str, str)),
+    "BACKUP_USER": ("backup_user", (str,)),
+    "RESTORE_USER": ("restore_user", (str,)),
+}
+
+
+def main() -> None:
+    run_cli(CloudStorage, QUERY_COMMANDS, "Run a stream of cloud storage queries.")
+
+
+if __name__ == "__main__":
+    main()
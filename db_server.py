@@ -0,0 +1,313 @@
+"""
+asyncio TCP front end for InMemoryDB, and a matching pooled client.
+
+The protocol is line based. A request is a query line in the format query_runner reads, e.g. "SET 5 key field 10",
+and every request gets one response line: the result formatted the way query_runner writes it, or
+"ERR <message>" if the query could not be run. Requests are pipelined: a client can send any number of them without
+waiting, responses come back in request order, and everything the server reads from a connection in one go is
+answered in a single write. Arguments are separated by whitespace, so they cannot contain any; DBClient rejects
+such arguments with ValueError instead of sending them.
+
+All connections share one InMemoryDB and queries are applied in timestamp order. The server collects queries for
+reorder_delay seconds, applies them sorted by timestamp and rejects a query whose timestamp is older than one it has
+already applied.
+
+A line that is not valid UTF-8 is answered with ERR like any other bad query. A connection that sends more than
+MAX_LINE_SIZE bytes without a newline gets one ERR line and is closed.
+"""
+
+import argparse
+import asyncio
+import heapq
+from collections import deque
+from collections.abc import Callable, Sequence
+from contextlib import suppress
+from typing import Any
+
+from in_memory_db import QUERY_COMMANDS, InMemoryDB
+from query_runner import format_result, parse_query
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7379
+DEFAULT_POOL_SIZE = 4
+READ_SIZE = 1 << 16
+MAX_LINE_SIZE = 1 << 20
+
+
+class ServerError(Exception):
+    pass
+
+
+class Sequencer:
+    """Applies the queries of all connections to one database, in timestamp order."""
+
+    def __init__(self, db: InMemoryDB, reorder_delay: float = 0.0) -> None:
+        self.db = db
+        self.methods = {op: getattr(db, method_name) for op, (method_name, _) in QUERY_COMMANDS.items()}
+        self.reorder_delay = reorder_delay
+        # (timestamp, arrival, operation, arguments, response)
+        self.queue: list[tuple[int, int, str, list[Any], asyncio.Future[str]]] = []
+        self.arrivals = 0
+        self.last_ts: int | None = None
+        self.scheduled = False
+
+    def submit(self, op: str, args: list[Any]) -> "asyncio.Future[str]":
+        loop = asyncio.get_running_loop()
+        response: asyncio.Future[str] = loop.create_future()
+        self.arrivals += 1
+        heapq.heappush(self.queue, (args[0], self.arrivals, op, args, response))
+        if not self.scheduled:
+            self.scheduled = True
+            loop.call_later(self.reorder_delay, self._apply)
+
+        return response
+
+    def _apply(self) -> None:
+        self.scheduled = False
+        while self.queue:
+            ts, _, op, args, response = heapq.heappop(self.queue)
+            if self.last_ts is not None and ts < self.last_ts:
+                response.set_result(f"ERR timestamp {ts} is older than the last applied timestamp {self.last_ts}")
+                continue
+
+            self.last_ts = ts
+            try:
+                res = format_result(self.methods[op](*args))
+            except Exception as e:
+                res = f"ERR {e}"
+            response.set_result(res)
+
+
+class DBServer:
+    def __init__(self, db: InMemoryDB | None = None, reorder_delay: float = 0.0) -> None:
+        self.sequencer = Sequencer(db if db is not None else InMemoryDB(), reorder_delay)
+
+    async def start(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port)
+
+    def _request(self, line: bytes) -> "asyncio.Future[str]":
+        try:
+            # UnicodeDecodeError is a ValueError
+            query = parse_query(line.decode(), QUERY_COMMANDS)
+        except ValueError as e:
+            response: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+            response.set_result(f"ERR {e}")
+            return response
+
+        # handle only passes non-blank lines
+        assert query is not None
+        return self.sequencer.submit(*query)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        partial = b""
+        try:
+            while chunk := await reader.read(READ_SIZE):
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()
+                responses = [self._request(line) for line in lines if line.strip()]
+                results = [await response for response in responses]
+                if len(partial) > MAX_LINE_SIZE:
+                    results.append(f"ERR request line longer than {MAX_LINE_SIZE} bytes")
+                if not results:
+                    continue
+
+                writer.write(("\n".join(results) + "\n").encode())
+                await writer.drain()
+                if len(partial) > MAX_LINE_SIZE:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+
+def parse_optional_int(response: str) -> int | None:
+    return int(response) if response else None
+
+
+def parse_bool(response: str) -> bool:
+    return response == "true"
+
+
+def parse_fields(response: str) -> list[str]:
+    return response.split(", ") if response else []
+
+
+def parse_none(response: str) -> None:
+    return None
+
+
+RESPONSE_PARSERS: dict[str, Callable[[str], Any]] = {
+    "SET": parse_none,
+    "GET": parse_optional_int,
+    "COMPARE_AND_SET": parse_bool,
+    "COMPARE_AND_DELETE": parse_bool,
+    "SCAN": parse_fields,
+    "SCAN_BY_PREFIX": parse_fields,
+    "SET_WITH_TTL": parse_none,
+    "COMPARE_AND_SET_WITH_TTL": parse_bool,
+    "BACKUP": str,
+    "RESTORE": parse_none,
+    "GET_AT": parse_optional_int,
+    "SCAN_AT": parse_fields,
+    "SCAN_BY_PREFIX_AT": parse_fields,
+}
+
+
+class Connection:
+    """
+    A pipelined client connection: requests are written as soon as they are issued and answered in order. Once the
+    server closes the connection or sends a response nothing was waiting for, the connection is unusable: unanswered
+    requests fail with ConnectionError, and so does every later send.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.pending: deque[asyncio.Future[str]] = deque()
+        self.closed_reason = "Connection closed by the server"
+        self.receiver = asyncio.create_task(self._receive())
+
+    async def _receive(self) -> None:
+        try:
+            while line := await self.reader.readline():
+                if not self.pending:
+                    # responses can no longer be matched to requests
+                    self.closed_reason = f"Unexpected response from the server: {line!r}"
+                    break
+
+                response = self.pending.popleft()
+                if not response.done():
+                    response.set_result(line.decode().rstrip("\n"))
+        except (ConnectionError, ValueError) as e:
+            self.closed_reason = f"Connection lost: {e}"
+        finally:
+            self.writer.close()
+            while self.pending:
+                response = self.pending.popleft()
+                if not response.done():
+                    response.set_exception(ConnectionError(self.closed_reason))
+
+    async def send(self, lines: Sequence[str]) -> list[str]:
+        if self.receiver.done():
+            raise ConnectionError(self.closed_reason)
+
+        loop = asyncio.get_running_loop()
+        responses: list[asyncio.Future[str]] = [loop.create_future() for _ in lines]
+        self.pending.extend(responses)
+        self.writer.write("".join(f"{line}\n" for line in lines).encode())
+        await self.writer.drain()
+        # gather also retrieves the failures of the responses after the first failed one
+        return await asyncio.gather(*responses)
+
+    async def close(self) -> None:
+        self.writer.close()
+        with suppress(ConnectionError):
+            await self.writer.wait_closed()
+        await self.receiver
+
+
+def request_line(op: str, args: Sequence[Any]) -> str:
+    """The query line for op and args. Raises ValueError for an argument the server would not read back as one."""
+    words = [op, *map(str, args)]
+    for word in words:
+        if word.split() != [word]:
+            raise ValueError(f"{op} arguments must be non-empty and contain no whitespace, got {word!r}")
+
+    return " ".join(words)
+
+
+def _query(op: str) -> Callable[..., Any]:
+    async def method(self: "DBClient", *args: Any) -> Any:
+        return await self.execute(op, *args)
+
+    method.__name__ = QUERY_COMMANDS[op][0]
+    return method
+
+
+class DBClient:
+    """
+    Client for DBServer with the InMemoryDB methods as coroutines. Requests are spread over a pool of pipelined
+    connections, each going to the connection with the fewest unanswered requests.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, pool_size: int = DEFAULT_POOL_SIZE) -> None:
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.connections: list[Connection] = []
+
+    async def __aenter__(self) -> "DBClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    async def connect(self) -> None:
+        for _ in range(self.pool_size - len(self.connections)):
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            self.connections.append(Connection(reader, writer))
+
+    async def close(self) -> None:
+        connections, self.connections = self.connections, []
+        for connection in connections:
+            await connection.close()
+
+    async def execute(self, op: str, *args: Any) -> Any:
+        (res,) = await self.execute_many([(op, args)])
+        return res
+
+    async def execute_many(self, queries: Sequence[tuple[str, Sequence[Any]]]) -> list[Any]:
+        """Sends the queries together on one connection and returns their results in order."""
+        lines = [request_line(op, args) for op, args in queries]
+        connection = min(self.connections, key=lambda c: len(c.pending))
+        responses = await connection.send(lines)
+
+        results = []
+        for (op, _), response in zip(queries, responses, strict=True):
+            if response.startswith("ERR "):
+                raise ServerError(response[len("ERR ") :])
+            results.append(RESPONSE_PARSERS[op](response))
+
+        return results
+
+    set = _query("SET")
+    get = _query("GET")
+    compare_and_set = _query("COMPARE_AND_SET")
+    compare_and_delete = _query("COMPARE_AND_DELETE")
+    scan = _query("SCAN")
+    scan_by_prefix = _query("SCAN_BY_PREFIX")
+    set_with_ttl = _query("SET_WITH_TTL")
+    compare_and_set_with_ttl = _query("COMPARE_AND_SET_WITH_TTL")
+    backup = _query("BACKUP")
+    restore = _query("RESTORE")
+    get_at = _query("GET_AT")
+    scan_at = _query("SCAN_AT")
+    scan_by_prefix_at = _query("SCAN_BY_PREFIX_AT")
+
+
+async def serve(host: str, port: int, db: InMemoryDB, reorder_delay: float) -> None:
+    server = await DBServer(db, reorder_delay).start(host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve an in-memory database over TCP.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--reorder-delay", type=float, default=0.0, help="seconds to collect queries for before applying them"
+    )
+    parser.add_argument("--history", action="store_true", help="keep field history for point-in-time reads")
+    parser.add_argument("--history-retention", type=int, help="how far back point-in-time reads reach")
+    args = parser.parse_args()
+    db = InMemoryDB(history=args.history, history_retention=args.history_retention)
+    asyncio.run(serve(args.host, args.port, db, args.reorder_delay))
+
+
+if __name__ == "__main__":
+    main()
@@ -90,48 +90,417 @@ Assumption: delete_at, set_at, set_at_with_ttl, .etc. should not affect existing
 
 """
 
-from copy import deepcopy
+import argparse
 import bisect
+import heapq
+import sys
+from array import array
+from collections.abc import Iterator, Sequence
+from itertools import islice
 
+from sortedcontainers import SortedList
 
-class Value:
-    def __init__(self, ts: int, value: int, ttl: int | None = None) -> None:
-        self.ts = ts
+from change_log import ChangeLog
+from query_runner import Command, run_cli
+
+
+class Expiring:
+    """A value set with a ttl. expiry is the first timestamp the value is no longer visible at."""
+
+    __slots__ = ("value", "expiry")
+
+    def __init__(self, value: int, expiry: int) -> None:
         self.value = value
-        self.ttl = ttl
+        self.expiry = expiry
+
+
+# Values set without a ttl are stored as bare ints.
+Stored = int | Expiring
 
-    def is_expired(self, timestamp: int) -> bool:
-        return self.ttl is not None and self.ttl + self.ts <= timestamp
+
+def stored_value(stored: Stored) -> int:
+    return stored.value if isinstance(stored, Expiring) else stored
 
 
 class Record:
+    """
+    Fields of one key. Values are never mutated and records are shared with backups, so a record is copied before
+    it is written to whenever its generation is older than the database's. Expiries and the timestamps passed to
+    its methods are in database time (see InMemoryDB.offset).
+    field_names keeps the keys of data in lexicographic order for scans; it is built by the first scan of the record
+    and maintained from then on.
+    """
+
+    __slots__ = ("generation", "data", "field_names")
+
+    def __init__(
+        self,
+        generation: int = 0,
+        data: dict[str, Stored] | None = None,
+        field_names: SortedList | None = None,
+    ) -> None:
+        self.generation = generation
+        self.data: dict[str, Stored] = {} if data is None else data
+        self.field_names: SortedList | None = field_names
+
+    def put(self, field: str, value: Stored) -> None:
+        if self.field_names is not None and field not in self.data:
+            self.field_names.add(field)
+        self.data[field] = value
+
+    def delete(self, field: str) -> None:
+        del self.data[field]
+        if self.field_names is not None:
+            self.field_names.remove(field)
+
+    def is_expired(self, value: Stored, timestamp: int) -> bool:
+        return isinstance(value, Expiring) and value.expiry <= timestamp
+
+    def get(self, field: str, timestamp: int) -> int | None:
+        value = self.data.get(field)
+        if value is None or self.is_expired(value, timestamp):
+            return None
+
+        return stored_value(value)
+
+    def copy(self, generation: int) -> "Record":
+        field_names = self.field_names.copy() if self.field_names is not None else None
+        return Record(generation, dict(self.data), field_names)
+
+    def sorted_fields(self) -> SortedList:
+        if self.field_names is None:
+            self.field_names = SortedList(self.data)
+
+        return self.field_names
+
+    def scan(self, timestamp: int, prefix: str = "") -> list[str]:
+        res = []
+        for field in self.sorted_fields().irange(minimum=prefix):
+            if not field.startswith(prefix):
+                break
+
+            value = self.data[field]
+            if not self.is_expired(value, timestamp):
+                res.append(f"{field}({stored_value(value)})")
+
+        return res
+
+
+class VersionChain:
+    """
+    Versions of one field, oldest first, in parallel arrays. values[i] is None for a deletion and ttls[i] is 0 for a
+    value set without a ttl.
+    """
+
+    __slots__ = ("timestamps", "values", "ttls")
+
     def __init__(self) -> None:
-        self.data: dict[str, Value] = {}
+        self.timestamps = array("q")
+        self.values: list[int | None] = []
+        self.ttls = array("q")
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def append(self, timestamp: int, value: int | None, ttl: int | None) -> None:
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+        self.ttls.append(ttl or 0)
+
+    def version_at(self, timestamp: int) -> int:
+        """Index of the version current at timestamp, or -1 if the field had no version yet."""
+        return bisect.bisect_right(self.timestamps, timestamp) - 1
+
+    def value_at(self, idx: int, timestamp: int) -> int | None:
+        value, ttl = self.values[idx], self.ttls[idx]
+        if value is None or (ttl and self.timestamps[idx] + ttl <= timestamp):
+            return None
+
+        return value
+
+    def trim(self, horizon: int) -> None:
+        """Drops the versions that were superseded at or before horizon."""
+        idx = self.version_at(horizon)
+        if idx > 0:
+            del self.timestamps[:idx]
+            del self.values[:idx]
+            del self.ttls[:idx]
+
+
+class Epoch:
+    """
+    History of the database from start until the next restore: the records it started from, which are never
+    written to, the database's offset while it lasted, and the versions of every field written since.
+    """
+
+    def __init__(self, start: int, base: dict[str, Record], offset: int = 0) -> None:
+        self.start = start
+        self.base = base
+        self.offset = offset
+        self.versions: dict[str, dict[str, VersionChain]] = {}
+
+    def value_at(self, key: str, field: str, timestamp: int) -> int | None:
+        chain = self.versions.get(key, {}).get(field)
+        if chain is not None and (idx := chain.version_at(timestamp)) >= 0:
+            return chain.value_at(idx, timestamp)
+
+        record = self.base.get(key)
+        return record.get(field, timestamp - self.offset) if record is not None else None
+
+    def fields(self, key: str) -> set[str]:
+        fields = set(self.versions.get(key, ()))
+        if (record := self.base.get(key)) is not None:
+            fields.update(record.data)
+
+        return fields
+
+
+# Maximum number of expiry heap entries a single operation processes.
+DEFAULT_REAP_BUDGET = 64
+
+
+class Backup:
+    """
+    The records of the database at one backup, and its offset then. A full backup holds every record; any other
+    holds only the records written since parent, the backup the database was last equal to, and the keys deleted
+    since. changes counts the records and keys in the deltas back to the nearest full backup.
+    """
+
+    def __init__(
+        self,
+        offset: int,
+        records: dict[str, Record],
+        parent: "Backup | None" = None,
+        deleted: Sequence[str] = (),
+        changes: int = 0,
+    ) -> None:
+        self.offset = offset
+        self.records = records
+        self.parent = parent
+        self.deleted = deleted
+        self.changes = changes
+
+    def materialize(self) -> dict[str, Record]:
+        """Every record of the backup. The result must not be written to: for a full backup it is records itself."""
+        chain = []
+        backup = self
+        while backup.parent is not None:
+            chain.append(backup)
+            backup = backup.parent
+        if not chain:
+            return backup.records
+
+        records = dict(backup.records)
+        for delta in reversed(chain):
+            records.update(delta.records)
+            for key in delta.deleted:
+                records.pop(key, None)
+
+        return records
 
 
 class InMemoryDB:
-    def __init__(self) -> None:
+    """
+    With history enabled, every write is also kept as a version of its field so get_at and scan_at can read the
+    database as of any past timestamp. history_retention bounds how far back: versions superseded more than
+    history_retention before the latest write are dropped, and history is compacted once per retention period.
+
+    With changes set, every write, deletion and restore is also appended to that ChangeLog, and so is every expired
+    field as it is reaped, timestamped with when it expired.
+    """
+
+    def __init__(
+        self,
+        reap_budget: int = DEFAULT_REAP_BUDGET,
+        history: bool = False,
+        history_retention: int | None = None,
+        changes: ChangeLog | None = None,
+    ) -> None:
+        # Every record has at least one field; a record is removed with its last field.
         self.records: dict[str, Record] = {}
-        self.backups: dict[int, dict[str, Record]] = dict()
+        # Bumped by every backup and restore; records from an older generation may be shared with a backup.
+        self.generation = 0
+        self.backups: dict[int, Backup] = dict()
+        self.backup_timestamps: list[int] = []
+        # The backup the records were last equal to, and the keys written or deleted since, which the next backup
+        # stores as its delta. A key is added when its record is created or copied, i.e. on its first write of the
+        # generation.
+        self.base: Backup | None = None
+        self.changed_keys: set[str] = set()
+        # Expiries are stored in database time, timestamp - offset. A restore moves offset forward by the time
+        # since its backup, which extends the ttl of every restored field without touching the records.
+        self.offset = 0
+
+        # (expiry, key, field) for every field set with a ttl. Entries for fields that were overwritten or deleted
+        # since are skipped when popped. Backups keep no entries: the reaper pushes the entries of restored fields
+        # from its budget, walking unqueued_records and, within the current one, unqueued_fields.
+        self.expiry_heap: list[tuple[int, str, str]] = []
+        self.unqueued_records: Iterator[tuple[str, Record]] = iter(())
+        self.unqueued_key = ""
+        self.unqueued_fields: Iterator[tuple[str, Stored]] = iter(())
+        self.reap_budget = reap_budget
+
+        self.history = history
+        self.history_retention = history_retention
+        # One epoch per restore; reads before history_horizon are no longer answerable.
+        self.epochs: list[Epoch] = [Epoch(0, {})]
+        self.epoch_starts: list[int] = [0]
+        self.history_horizon = 0
+        self.next_compaction = 0
+
+        self.changes = changes
+
+    def _queue_restored(self, budget: int) -> int:
+        """Pushes the heap entries of up to budget restored fields and returns what is left of budget."""
+        heap = self.expiry_heap
+        while budget > 0:
+            key = self.unqueued_key
+            for field, stored in islice(self.unqueued_fields, budget):
+                budget -= 1
+                if isinstance(stored, Expiring):
+                    heapq.heappush(heap, (stored.expiry, key, field))
+            if not budget:
+                break
+
+            # the current record is done
+            restored = next(self.unqueued_records, None)
+            if restored is None:
+                break
+            self.unqueued_key, record = restored
+            self.unqueued_fields = iter(record.data.items())
+
+        return budget
+
+    def _queue_all_restored(self) -> None:
+        """Pushes the heap entries of every restored field still unqueued, in one go."""
+        key = self.unqueued_key
+        entries = [
+            (stored.expiry, key, field) for field, stored in self.unqueued_fields if isinstance(stored, Expiring)
+        ]
+        entries.extend(
+            (stored.expiry, key, field)
+            for key, record in self.unqueued_records
+            for field, stored in record.data.items()
+            if isinstance(stored, Expiring)
+        )
+        if entries:
+            self.expiry_heap.extend(entries)
+            heapq.heapify(self.expiry_heap)
+
+    def _reap(self, timestamp: int, budget: int | None = None) -> None:
+        heap = self.expiry_heap
+        budget = self._queue_restored(self.reap_budget if budget is None else budget)
+        now = timestamp - self.offset
+        while heap and budget > 0 and heap[0][0] <= now:
+            expiry, key, field = heapq.heappop(heap)
+            budget -= 1
+
+            record = self.records.get(key)
+            value = record.data.get(field) if record is not None else None
+            if record is None or value is None or not isinstance(value, Expiring) or value.expiry != expiry:
+                continue
+
+            record = self._writable_record(key)
+            record.delete(field)
+            if not record.data:
+                del self.records[key]
+            if self.changes is not None:
+                self.changes.append(expiry + self.offset, "field_expired", key, field)
+
+    def _writable_record(self, key: str) -> Record:
+        record = self.records.get(key)
+        if record is None:
+            record = self.records[key] = Record(self.generation)
+            self.changed_keys.add(key)
+        elif record.generation != self.generation:
+            record = self.records[key] = record.copy(self.generation)
+            self.changed_keys.add(key)
+
+        return record
+
+    def _record_version(self, timestamp: int, key: str, field: str, value: int | None, ttl: int | None = None) -> None:
+        if not self.history:
+            return
+
+        chains = self.epochs[-1].versions.setdefault(key, {})
+        chain = chains.get(field)
+        if chain is None:
+            chain = chains[field] = VersionChain()
+        chain.append(timestamp, value, ttl)
+
+        if self.history_retention is not None:
+            self.history_horizon = max(self.history_horizon, timestamp - self.history_retention)
+            chain.trim(self.history_horizon)
+            if timestamp >= self.next_compaction:
+                self.compact_history()
+                self.next_compaction = timestamp + self.history_retention
+
+    def compact_history(self) -> None:
+        """Drops epochs, versions and fields that no read at or after history_horizon can see."""
+        horizon = self.history_horizon
+        first = max(0, bisect.bisect_right(self.epoch_starts, horizon) - 1)
+        del self.epochs[:first]
+        del self.epoch_starts[:first]
+
+        for epoch in self.epochs:
+            for key, chains in list(epoch.versions.items()):
+                base = epoch.base.get(key)
+                for field, chain in list(chains.items()):
+                    chain.trim(horizon)
+                    if (
+                        len(chain) == 1
+                        and chain.timestamps[0] <= horizon
+                        and chain.value_at(0, horizon) is None
+                        and (base is None or field not in base.data)
+                    ):
+                        del chains[field]
+                if not chains:
+                    del epoch.versions[key]
+
+    def _epoch_at(self, time_at: int) -> Epoch | None:
+        if not self.history:
+            raise ValueError("Point-in-time reads need an InMemoryDB created with history=True")
+        if time_at < self.history_horizon:
+            raise ValueError(f"History before {self.history_horizon} is no longer retained")
+
+        idx = bisect.bisect_right(self.epoch_starts, time_at) - 1
+        return self.epochs[idx] if idx >= 0 else None
+
+    def get_at(self, timestamp: int, key: str, field: str, time_at: int) -> int | None:
+        epoch = self._epoch_at(time_at)
+        return epoch.value_at(key, field, time_at) if epoch is not None else None
+
+    def scan_at(self, timestamp: int, key: str, time_at: int) -> list[str]:
+        return self.scan_by_prefix_at(timestamp, key, "", time_at)
+
+    def scan_by_prefix_at(self, timestamp: int, key: str, prefix: str, time_at: int) -> list[str]:
+        epoch = self._epoch_at(time_at)
+        if epoch is None:
+            return []
 
-    def set(self, timestamp: int, key: str, field: str, value: int) -> None:
-        if key not in self.records:
-            self.records[key] = Record()
+        res = []
+        for field in sorted(f for f in epoch.fields(key) if f.startswith(prefix)):
+            value = epoch.value_at(key, field, time_at)
+            if value is not None:
+                res.append(f"{field}({value})")
 
-        self.records[key].data[field] = Value(ts=timestamp, value=value)
+        return res
+
+    def set(self, timestamp: int, key: str, field: str, value: int) -> None:
+        self._reap(timestamp)
+        # field names repeat across records; interning stores each distinct name once
+        field = sys.intern(field)
+        self._writable_record(key).put(field, value)
+        self._record_version(timestamp, key, field, value)
+        if self.changes is not None:
+            self.changes.append(timestamp, "field_set", key, field, value, None)
 
     def get(self, timestamp: int, key: str, field: str) -> int | None:
+        self._reap(timestamp)
         if key not in self.records:
             return None
 
-        if field not in self.records[key].data:
-            return None
-
-        value_obj = self.records[key].data[field]
-        if value_obj.is_expired(timestamp):
-            return None
-
-        return value_obj.value
+        return self.records[key].get(field, timestamp - self.offset)
 
     def compare_and_set(self, timestamp: int, key: str, field: str, expected_value: int, new_value: int) -> bool:
         curr_val = self.get(timestamp, key, field)
@@ -146,38 +515,40 @@ class InMemoryDB:
         curr_val = self.get(timestamp, key, field)
 
         if curr_val is not None and curr_val == expected_value:
-            del self.records[key].data[field]
+            record = self._writable_record(key)
+            record.delete(field)
+            if not record.data:
+                del self.records[key]
+            self._record_version(timestamp, key, field, None)
+            if self.changes is not None:
+                self.changes.append(timestamp, "field_deleted", key, field)
             return True
 
         return False
 
     def scan(self, timestamp: int, key: str) -> list[str]:
+        self._reap(timestamp)
         if key not in self.records:
             return []
 
-        fields = self.records[key].data
-        field_keys = sorted(fields.keys())
-
-        return list(f"{k}({fields[k].value})" for k in field_keys if not fields[k].is_expired(timestamp))
+        return self.records[key].scan(timestamp - self.offset)
 
     def scan_by_prefix(self, timestamp: int, key: str, prefix: str) -> list[str]:
+        self._reap(timestamp)
         if key not in self.records:
             return []
 
-        fields = self.records[key].data
-        field_keys = sorted(fields.keys())
-
-        return list(
-            f"{k}({fields[k].value})"
-            for k in field_keys
-            if k.startswith(prefix) and not fields[k].is_expired(timestamp)
-        )
+        return self.records[key].scan(timestamp - self.offset, prefix)
 
     def set_with_ttl(self, timestamp: int, key: str, field: str, value: int, ttl: int) -> None:
-        if key not in self.records:
-            self.records[key] = Record()
-
-        self.records[key].data[field] = Value(ts=timestamp, value=value, ttl=ttl)
+        self._reap(timestamp)
+        field = sys.intern(field)
+        expiry = timestamp - self.offset + ttl
+        self._writable_record(key).put(field, Expiring(value, expiry))
+        heapq.heappush(self.expiry_heap, (expiry, key, field))
+        self._record_version(timestamp, key, field, value, ttl)
+        if self.changes is not None:
+            self.changes.append(timestamp, "field_set", key, field, value, ttl)
 
     def compare_and_set_with_ttl(
         self, timestamp: int, key: str, field: str, expected_value: int, new_value: int, ttl: int
@@ -191,37 +562,94 @@ class InMemoryDB:
         return False
 
     def backup(self, timestamp: int) -> str:
-        count = 0
-        records_copy = deepcopy(self.records)
-
-        for r in records_copy.values():
-            has_valid_field = False
-            for v in r.data.values():
-                if not v.is_expired(timestamp):
-                    has_valid_field = True
-                    v.ts = timestamp
-                    if v.ttl is not None:
-                        v.ttl -= timestamp - v.ts
-
-            if has_valid_field:
-                count += 1
-
-        self.backups[timestamp] = records_copy
-        return str(count)
+        # With every expired field reaped, the records left are exactly the live ones. This is amortized over the
+        # writes and restores that pushed the entries; the rest of a backup is proportional to the changed keys.
+        self._queue_all_restored()
+        self._reap(timestamp, sys.maxsize)
+
+        # The backup shares every record with the live database; records are copied on their next write. It
+        # stores the changed keys as a delta against base, unless the deltas back to the last full backup would add
+        # up to more than the records themselves.
+        self.generation += 1
+        changes = len(self.changed_keys) + (self.base.changes if self.base is not None else 0)
+        if self.base is None or changes > len(self.records):
+            backup = Backup(self.offset, dict(self.records))
+        else:
+            written = {}
+            deleted = []
+            for key in self.changed_keys:
+                record = self.records.get(key)
+                if record is None:
+                    deleted.append(key)
+                else:
+                    written[key] = record
+            backup = Backup(self.offset, written, self.base, deleted, changes)
+        self.backups[timestamp] = self.base = backup
+        self.backup_timestamps.append(timestamp)
+        self.changed_keys = set()
+
+        return str(len(self.records))
 
     def restore(self, timestamp: int, timestamp_to_restore: int) -> None:
-        timestamp_keys = sorted(self.backups.keys())
-
-        idx = bisect.bisect_right(timestamp_keys, timestamp_to_restore) - 1
+        idx = bisect.bisect_right(self.backup_timestamps, timestamp_to_restore) - 1
         if idx >= 0:
-            ts_to_use = timestamp_keys[idx]
-
-            backup_to_use = deepcopy(self.backups[ts_to_use])
-
-            for field in backup_to_use.values():
-                for v in field.data.values():
-                    if v.ttl is not None:
-                        v.ttl -= timestamp - ts_to_use
-                    v.ts = timestamp
-
-            self.records = backup_to_use
+            ts_to_use = self.backup_timestamps[idx]
+
+            # Restored fields keep the ttl they had left at backup time, counted from now.
+            backup = self.backups[ts_to_use]
+            restored = backup.materialize()
+            self.generation += 1
+            self.records = dict(restored)
+            self.offset = backup.offset + timestamp - ts_to_use
+            self.base = backup
+            self.changed_keys = set()
+            # entries of the replaced records are all stale; the restored ones are queued a budget at a time.
+            # restored records are copied before they are written to, so neither the queue nor the epoch sees writes.
+            self.expiry_heap = []
+            self.unqueued_records = iter(restored.items())
+            self.unqueued_fields = iter(())
+
+            if self.history:
+                self.epochs.append(Epoch(timestamp, restored, self.offset))
+                self.epoch_starts.append(timestamp)
+
+            if self.changes is not None:
+                self.changes.append(timestamp, "restored", "", timestamp_to_restore)
+
+
+QUERY_COMMANDS: dict[str, Command] = {
+    "SET": ("set", (int, str, str, int)),
+    "GET": ("get", (int, str, str)),
+    "COMPARE_AND_SET": ("compare_and_set", (int, str, str, int, int)),
+    "COMPARE_AND_DELETE": ("compare_and_delete", (int, str, str, int)),
+    "SCAN": ("scan", (int, str)),
+    "SCAN_BY_PREFIX": ("scan_by_prefix", (int, str, str)),
+    "SET_WITH_TTL": ("set_with_ttl", (int, str, str, int, int)),
+    "COMPARE_AND_SET_WITH_TTL": ("compare_and_set_with_ttl", (int, str, str, int, int, int)),
+    "BACKUP": ("backup", (int,)),
+    "RESTORE": ("restore", (int, int)),
+    "GET_AT": ("get_at", (int, str, str, int)),
+    "SCAN_AT": ("scan_at", (int, str, int)),
+    "SCAN_BY_PREFIX_AT": ("scan_by_prefix_at", (int, str, str, int)),
+}
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument("--history", action="store_true", help="keep field history for point-in-time reads")
+    options.add_argument(
+        "--history-retention", type=int, help="how far back point-in-time reads reach; implies --history"
+    )
+    args, _ = options.parse_known_args(argv)
+    history = args.history or args.history_retention is not None
+    run_cli(
+        lambda: InMemoryDB(history=history, history_retention=args.history_retention),
+        QUERY_COMMANDS,
+        "Run a stream of in-memory database queries.",
+        argv,
+        [options],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Opt-in instrumentation for Bank, InMemoryDB and CloudStorage.
+
+instrument(system) replaces the operations of one instance, and the internal hot paths listed in its Profile, with
+wrappers that count calls and errors and record latency histograms. For scan-like operations it also records how
+many records each call had to look at. Gauges such as pending payments or stored backups are read from the
+instance only when a snapshot is taken. Instances that were never instrumented, or were uninstrumented since, run
+the plain methods, so disabled instrumentation costs nothing.
+
+    metrics = instrument(bank)
+    ...
+    metrics.snapshot()       # nested dict
+    metrics.to_prometheus()  # Prometheus text exposition format
+"""
+
+from bisect import bisect_left
+from collections.abc import Callable
+from functools import partial
+from time import perf_counter_ns
+from typing import Any
+
+from sortedcontainers import SortedList
+
+import banking_system
+import cloud_storage
+import in_memory_db
+from query_runner import Command
+
+# upper bounds, in seconds
+LATENCY_BUCKETS = (
+    1e-6,
+    2.5e-6,
+    5e-6,
+    1e-5,
+    2.5e-5,
+    5e-5,
+    1e-4,
+    2.5e-4,
+    5e-4,
+    1e-3,
+    2.5e-3,
+    5e-3,
+    1e-2,
+    2.5e-2,
+    1e-1,
+    1.0,
+)
+# upper bounds, in records
+COUNT_BUCKETS = (0, 1, 4, 16, 64, 256, 1024, 4096, 16384, 65536, 262144)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        # counts[i] is the number of observations in (bounds[i - 1], bounds[i]]; the last one has no upper bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(upper bound, observations at or below it) pairs, ending with +Inf."""
+        res = []
+        total = 0
+        for bound, count in zip([*map(str, self.bounds), "+Inf"], self.counts, strict=True):
+            total += count
+            res.append((bound, total))
+
+        return res
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"count": self.count, "sum": self.sum, "buckets": dict(self.cumulative())}
+
+
+class Profile:
+    """
+    What to instrument on one kind of system: its operations, the internal methods worth timing on their own, the
+    gauges to read at snapshot time and, per scan-like operation, a probe returning how many records the call that
+    just ran looked at.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        commands: dict[str, Command],
+        internals: tuple[str, ...],
+        gauges: dict[str, Callable[[Any], float]],
+        scanned: dict[str, Callable[..., int]],
+    ) -> None:
+        self.namespace = namespace
+        self.commands = commands
+        self.internals = internals
+        self.gauges = gauges
+        self.scanned = scanned
+
+
+class Metrics:
+    def __init__(self, namespace: str) -> None:
+        self.namespace = namespace
+        self.operations: dict[str, Histogram] = {}
+        self.errors: dict[str, int] = {}
+        self.internals: dict[str, Histogram] = {}
+        self.scanned: dict[str, Histogram] = {}
+        self.gauges: dict[str, Callable[[], float]] = {}
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "operations": {
+                op: {**histogram.snapshot(), "errors": self.errors.get(op, 0)}
+                for op, histogram in self.operations.items()
+            },
+            "internals": {name: histogram.snapshot() for name, histogram in self.internals.items()},
+            "records_scanned": {op: histogram.snapshot() for op, histogram in self.scanned.items()},
+            "gauges": {name: gauge() for name, gauge in self.gauges.items()},
+        }
+
+    def to_prometheus(self) -> str:
+        ns = self.namespace
+        lines = [
+            f"# HELP {ns}_operations_total Operations run, by operation.",
+            f"# TYPE {ns}_operations_total counter",
+        ]
+        lines += [f'{ns}_operations_total{{operation="{op}"}} {h.count}' for op, h in self.operations.items()]
+        lines += [
+            f"# HELP {ns}_operation_errors_total Operations that raised, by operation.",
+            f"# TYPE {ns}_operation_errors_total counter",
+        ]
+        lines += [f'{ns}_operation_errors_total{{operation="{op}"}} {n}' for op, n in self.errors.items()]
+        lines += histogram_lines(f"{ns}_operation_duration_seconds", "Operation latency.", "operation", self.operations)
+        lines += histogram_lines(
+            f"{ns}_internal_duration_seconds", "Latency of internal hot paths.", "function", self.internals
+        )
+        lines += histogram_lines(f"{ns}_records_scanned", "Records looked at per call.", "operation", self.scanned)
+        for name, gauge in self.gauges.items():
+            lines += [f"# TYPE {ns}_{name} gauge", f"{ns}_{name} {gauge()}"]
+
+        return "\n".join(lines) + "\n"
+
+
+def histogram_lines(name: str, help_text: str, label: str, histograms: dict[str, Histogram]) -> list[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for value, histogram in histograms.items():
+        for bound, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {count}')
+        lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.sum}')
+        lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+
+    return lines
+
+
+def count_prefix(names: SortedList, prefix: str) -> int:
+    if not prefix:
+        return len(names)
+
+    end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return int(names.bisect_left(end) - names.bisect_left(prefix))
+
+
+def db_fields_scanned(db: in_memory_db.InMemoryDB, timestamp: int, key: str, prefix: str = "") -> int:
+    record = db.records.get(key)
+    return count_prefix(record.sorted_fields(), prefix) if record is not None else 0
+
+
+def storage_files_scanned(storage: cloud_storage.CloudStorage, prefix: str, n: int) -> int:
+    catalog = storage.catalog
+    if len(prefix) <= cloud_storage.INDEXED_PREFIX_LENGTH:
+        return min(max(n, 0), len(catalog.by_prefix.get(prefix, ())))
+
+    return count_prefix(catalog.names, prefix)
+
+
+PROFILES: list[tuple[type, Profile]] = [
+    (
+        banking_system.Bank,
+        Profile(
+            "bank",
+            banking_system.QUERY_COMMANDS,
+            ("_expire_transfers", "_process_scheduled_payments", "_merge_accounts"),
+            {
+                "accounts": lambda bank: len(bank.accounts),
+                "pending_payments": lambda bank: len(bank.scheduled_payments),
+                "pending_transfers": lambda bank: len(bank.pending_transfers),
+                "completed_payments": lambda bank: len(bank.completed_payments),
+            },
+            {},
+        ),
+    ),
+    (
+        in_memory_db.InMemoryDB,
+        Profile(
+            "in_memory_db",
+            in_memory_db.QUERY_COMMANDS,
+            ("_reap",),
+            {
+                "records": lambda db: len(db.records),
+                "backups": lambda db: len(db.backups),
+                "expiry_heap_entries": lambda db: len(db.expiry_heap),
+                "history_epochs": lambda db: len(db.epochs),
+            },
+            {"SCAN": db_fields_scanned, "SCAN_BY_PREFIX": db_fields_scanned},
+        ),
+    ),
+    (
+        cloud_storage.CloudStorage,
+        Profile(
+            "cloud_storage",
+            cloud_storage.QUERY_COMMANDS,
+            ("_changed_since_backup",),
+            {
+                "files": lambda storage: len(storage.storage),
+                "users": lambda storage: len(storage.users),
+                "backed_up_users": lambda storage: sum(bool(u.backup) for u in storage.users.values()),
+            },
+            {"GET_N_LARGEST": storage_files_scanned},
+        ),
+    ),
+]
+
+
+def profile_of(system: object) -> Profile:
+    for cls, profile in PROFILES:
+        if isinstance(system, cls):
+            return profile
+
+    raise ValueError(f"No instrumentation profile for {type(system).__name__}")
+
+
+def timed(method: Callable[..., Any], histogram: Histogram) -> Callable[..., Any]:
+    def wrapper(*args: Any) -> Any:
+        start = perf_counter_ns()
+        try:
+            return method(*args)
+        finally:
+            histogram.observe((perf_counter_ns() - start) / 1e9)
+
+    return wrapper
+
+
+def timed_operation(
+    system: object,
+    op: str,
+    method: Callable[..., Any],
+    metrics: Metrics,
+    probe: Callable[..., int] | None,
+) -> Callable[..., Any]:
+    histogram = metrics.operations.setdefault(op, Histogram(LATENCY_BUCKETS))
+    scanned = metrics.scanned.setdefault(op, Histogram(COUNT_BUCKETS)) if probe is not None else None
+
+    def wrapper(*args: Any) -> Any:
+        start = perf_counter_ns()
+        try:
+            res = method(*args)
+        except Exception:
+            metrics.errors[op] = metrics.errors.get(op, 0) + 1
+            raise
+        finally:
+            histogram.observe((perf_counter_ns() - start) / 1e9)
+
+        if probe is not None and scanned is not None:
+            scanned.observe(probe(system, *args))
+        return res
+
+    return wrapper
+
+
+def instrument(system: object, metrics: Metrics | None = None) -> Metrics:
+    """Instruments one Bank, InMemoryDB or CloudStorage instance and returns the metrics it records into."""
+    profile = profile_of(system)
+    uninstrument(system)
+    metrics = metrics if metrics is not None else Metrics(profile.namespace)
+
+    for op, (method_name, _) in profile.commands.items():
+        method = getattr(system, method_name)
+        setattr(system, method_name, timed_operation(system, op, method, metrics, profile.scanned.get(op)))
+
+    for name in profile.internals:
+        histogram = metrics.internals.setdefault(name, Histogram(LATENCY_BUCKETS))
+        setattr(system, name, timed(getattr(system, name), histogram))
+
+    for name, gauge in profile.gauges.items():
+        metrics.gauges[name] = partial(gauge, system)
+
+    return metrics
+
+
+def uninstrument(system: object) -> None:
+    """Removes the wrappers instrument installed; the instance goes back to its plain methods."""
+    profile = profile_of(system)
+    for method_name, _ in profile.commands.values():
+        vars(system).pop(method_name, None)
+    for name in profile.internals:
+        vars(system).pop(name, None)
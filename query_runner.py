@@ -0,0 +1,141 @@
+"""
+Streams query lines into one of the systems and writes one result line per query.
+
+A query line is the operation name followed by its whitespace separated arguments, as in the module docstrings,
+e.g. "CREATE_ACCOUNT 1 account1" or "SET 5 key field 10". Lines are read lazily and results are written in batches,
+so memory use does not depend on the length of the stream. Results are formatted the way the problem statements
+expect them: booleans as "true"/"false", None as an empty string and lists joined with ", ".
+"""
+
+import argparse
+import sys
+from collections.abc import Callable, Iterable, Sequence
+from time import perf_counter, perf_counter_ns
+from typing import IO, Any
+
+# operation name -> (method name, one converter per argument)
+Command = tuple[str, tuple[Callable[[str], Any], ...]]
+
+DEFAULT_BATCH_SIZE = 4096
+
+
+class OperationStats:
+    __slots__ = ("count", "total_ns", "max_ns")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, elapsed_ns: int) -> None:
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+
+def format_result(res: Any) -> str:
+    if res is None:
+        return ""
+    if isinstance(res, bool):
+        return "true" if res else "false"
+    if isinstance(res, list):
+        return ", ".join(res)
+
+    return str(res)
+
+
+def parse_query(line: str, commands: dict[str, Command]) -> tuple[str, list[Any]] | None:
+    """Returns the operation of a query line and its converted arguments, or None for a blank line."""
+    parts = line.split()
+    if not parts:
+        return None
+
+    op = parts[0].upper()
+    if op not in commands:
+        raise ValueError(f"Unknown operation {parts[0]!r}")
+
+    converters = commands[op][1]
+    if len(parts) - 1 != len(converters):
+        raise ValueError(f"{op} expects {len(converters)} arguments, got {len(parts) - 1}")
+
+    return op, [convert(arg) for convert, arg in zip(converters, parts[1:], strict=True)]
+
+
+def run_queries(
+    system: object,
+    commands: dict[str, Command],
+    lines: Iterable[str],
+    out: IO[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict[str, OperationStats]:
+    methods = {op: getattr(system, method_name) for op, (method_name, _) in commands.items()}
+    stats = {op: OperationStats() for op in commands}
+
+    batch: list[str] = []
+    for line_number, line in enumerate(lines, start=1):
+        try:
+            query = parse_query(line, commands)
+        except ValueError as e:
+            raise ValueError(f"{e} on line {line_number}") from None
+        if query is None:
+            continue
+
+        op, args = query
+        method = methods[op]
+        start = perf_counter_ns()
+        res = method(*args)
+        stats[op].record(perf_counter_ns() - start)
+
+        batch.append(format_result(res))
+        if len(batch) >= batch_size:
+            out.write("\n".join(batch))
+            out.write("\n")
+            batch.clear()
+
+    if batch:
+        out.write("\n".join(batch))
+        out.write("\n")
+
+    return stats
+
+
+def write_stats(stats: dict[str, OperationStats], elapsed: float, out: IO[str]) -> None:
+    total = sum(s.count for s in stats.values())
+    ops_per_sec = total / elapsed if elapsed > 0 else 0.0
+    out.write(f"{total} operations in {elapsed:.3f}s ({ops_per_sec:,.0f} ops/sec)\n")
+    out.write(f"{'operation':<26} {'count':>10} {'mean (us)':>12} {'max (us)':>12}\n")
+    for op, s in stats.items():
+        if s.count:
+            out.write(f"{op:<26} {s.count:>10} {s.total_ns / s.count / 1000:>12.2f} {s.max_ns / 1000:>12.2f}\n")
+
+
+def run_cli(
+    factory: Callable[[], object],
+    commands: dict[str, Command],
+    description: str,
+    argv: Sequence[str] | None = None,
+    parents: Sequence[argparse.ArgumentParser] = (),
+) -> None:
+    """parents are parsers of options the caller reads itself to configure factory; they are listed in --help."""
+    parser = argparse.ArgumentParser(description=description, parents=list(parents))
+    parser.add_argument("queries", nargs="?", default="-", help="file of query lines, or - for stdin (default)")
+    parser.add_argument("-o", "--output", default="-", help="file to write results to, or - for stdout (default)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="results written per flush")
+    parser.add_argument("--stats", action="store_true", help="report ops/sec and per-operation latency on stderr")
+    args = parser.parse_args(argv)
+
+    queries = sys.stdin if args.queries == "-" else open(args.queries, encoding="utf-8")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        start = perf_counter()
+        stats = run_queries(factory(), commands, queries, out, args.batch_size)
+        elapsed = perf_counter() - start
+    finally:
+        if queries is not sys.stdin:
+            queries.close()
+        if out is not sys.stdout:
+            out.close()
+
+    if args.stats:
+        write_stats(stats, elapsed, sys.stderr)
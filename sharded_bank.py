@@ -0,0 +1,560 @@
+"""
+Bank partitioned by account id across worker processes.
+
+ShardedBank runs a stream of operations, in the vocabulary of banking_system.QUERY_COMMANDS, over a pool of
+ShardBank processes and returns the same results a single Bank would for the same strictly increasing stream.
+
+Every account lives on exactly one shard, together with its scheduled and completed payments and the pending
+transfers it is the source of. The front end tracks which accounts exist and where, which transfers are pending
+and the merged account aliases, so it can answer or route every operation without waiting on the shards:
+- Each operation gets a global sequence number. Shards use it as the ordinal of any payment or transfer it creates,
+  so payments due at the same time keep their creation order on every shard. The front end maps it to the public
+  "paymentN"/"transferN" id once the creating operation's result comes back.
+- Every shard receives every operation's timestamp, not only its own operations, and performs due payments and
+  transfer expiries at the same timestamps a single Bank would.
+- A cross-shard accept_transfer debits the source shard and credits the target shard at the same position in the
+  stream.
+- In a cross-shard merge_accounts, the shard holding the second account hands its state straight to the shard of the
+  first account, which waits for it at the same position in the stream and merges it like a local merge. The front
+  end does not wait: it already knows the outcome.
+- top_activity and top_spenders merge the per-shard top n.
+
+Operations are sent in windows of up to window_size operations; the front end only waits on the shards to resolve
+an id whose creating operation is still in flight.
+"""
+
+import heapq
+import os
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from itertools import islice
+from multiprocessing import get_context
+from multiprocessing.queues import Queue
+from typing import Any
+
+from banking_system import (
+    MILLISECONDS_IN_1_DAY,
+    QUERY_COMMANDS,
+    AccountAliases,
+    AccountRow,
+    Bank,
+    Payment,
+    Transfer,
+    format_ranking,
+    parse_str_to_int,
+)
+
+DEFAULT_WINDOW_SIZE = 4096
+# Transfer.target on a shard, which does not know the nodes of accounts on other shards; the front end checks targets.
+UNKNOWN_TARGET = -1
+
+# (position in the message's timestamps, sequence number, ShardBank method, arguments after the timestamp, reply)
+ShardOperation = tuple[int, int, str, tuple[Any, ...], bool]
+# account id, its row, its scheduled payments, its completed payments and the pending transfers it is the source of
+AccountState = tuple[str, AccountRow, list[Payment], list[Payment], dict[int, Transfer]]
+
+
+def shard_of(account_id: str, num_shards: int) -> int:
+    return zlib.crc32(account_id.encode()) % num_shards
+
+
+class ShardBank(Bank):
+    """
+    One partition of a ShardedBank. Operations arrive with the sequence number they were issued at, which becomes
+    the ordinal of the payment or transfer they create. The front end has already checked that the accounts they
+    name exist and has resolved merged account ids.
+
+    handoffs holds every shard's queue of account states handed over for a cross-shard merge, by shard. Shards do
+    not reach the same merge at the same time, so states read from this shard's queue are kept in handed_over, by
+    the sequence number of their merge, until that merge comes up.
+
+    outgoing_transfers indexes the pending transfers by source account, so handing an account over does not scan
+    every pending transfer. Ordinals of transfers accepted or expired since are skipped then; once they make up
+    more than half of the index, it is rebuilt from pending_transfers.
+    """
+
+    def __init__(self, shard: int = 0, handoffs: Sequence["Queue[Any]"] = ()) -> None:
+        super().__init__()
+        self.shard = shard
+        self.handoffs = handoffs
+        self.handed_over: dict[int, AccountState] = {}
+        self.outgoing_transfers: dict[int, list[int]] = {}
+        self.outgoing_count = 0
+
+    def apply(self, timestamps: Sequence[int], ops: Sequence[ShardOperation]) -> list[Any]:
+        results = []
+        advanced = 0
+        self.deferred_ranks = set()
+        try:
+            for index, seq, method_name, args, reply in ops:
+                self._advance_through(timestamps, advanced, index)
+                ts = timestamps[index]
+                self._advance(ts)
+                advanced = index + 1
+
+                if method_name == "_top_entries" and self.deferred_ranks:
+                    self._flush_deferred_ranks()
+                    self.deferred_ranks = set()
+
+                self.payment_ordinal = self.transfer_ordinal = seq - 1
+                res = getattr(self, method_name)(ts, *args)
+                if reply:
+                    results.append(res)
+
+            self._advance_through(timestamps, advanced, len(timestamps))
+        finally:
+            self._flush_deferred_ranks()
+
+        return results
+
+    def _advance_through(self, timestamps: Sequence[int], lo: int, hi: int) -> None:
+        """Advances time as if an operation had run at each of timestamps[lo:hi], skipping those with nothing due."""
+        while lo < hi:
+            due = self._next_due()
+            if due is None:
+                return
+
+            lo = bisect_left(timestamps, due, lo, hi)
+            if lo == hi:
+                return
+
+            self._advance(timestamps[lo])
+            lo += 1
+
+    def _transfer(self, ts: int, source_account_id: str, target_account_id: str, amount: int) -> str:
+        number = self.accounts[source_account_id]
+        # the target may live on another shard
+        transfer_id = self._hold_transfer(ts, number, UNKNOWN_TARGET, amount)
+        if transfer_id:
+            self._index_outgoing(number, [self.transfer_ordinal])
+        return transfer_id
+
+    def _index_outgoing(self, number: int, ordinals: list[int]) -> None:
+        self.outgoing_transfers.setdefault(number, []).extend(ordinals)
+        self.outgoing_count += len(ordinals)
+        if self.outgoing_count > 2 * len(self.pending_transfers) + 1024:
+            self.outgoing_transfers = {}
+            for ordinal, transfer in self.pending_transfers.items():
+                self.outgoing_transfers.setdefault(self.aliases.find(transfer.source), []).append(ordinal)
+            self.outgoing_count = len(self.pending_transfers)
+
+    def _merge_accounts(self, timestamp: int, account_id_1: str, account_id_2: str) -> bool:
+        number_2 = self.accounts.get(account_id_2)
+        if not super()._merge_accounts(timestamp, account_id_1, account_id_2):
+            return False
+
+        assert number_2 is not None
+        ordinals = self.outgoing_transfers.pop(number_2, [])
+        self.outgoing_count -= len(ordinals)
+        self._index_outgoing(self.accounts[account_id_1], ordinals)
+        return True
+
+    def _hand_over(self, ts: int, account_id: str, shard: int, seq: int) -> None:
+        self.handoffs[shard].put((seq, self._extract_account(ts, account_id)))
+
+    def _extract_account(self, ts: int, account_id: str) -> AccountState:
+        number = self.accounts.pop(account_id)
+        self._unrank(number)
+
+        table = self.account_table
+        payment_ids = table.payment_ids[number] or ()
+        scheduled = [self.scheduled_payments.pop(p) for p in payment_ids if p in self.scheduled_payments]
+        completed = [self.completed_payments.pop(p) for p in payment_ids if p in self.completed_payments]
+        table.payment_ids[number] = [payment.payment_id for payment in scheduled + completed] or None
+        row = table.row(number)
+        # the row stays behind, unreachable; release what it holds
+        table.transactions[number], table.payment_ids[number] = None, None
+
+        ordinals = self.outgoing_transfers.pop(number, [])
+        self.outgoing_count -= len(ordinals)
+        transfers = {
+            ordinal: self.pending_transfers.pop(ordinal) for ordinal in ordinals if ordinal in self.pending_transfers
+        }
+
+        return account_id, row, scheduled, completed, transfers
+
+    def _take_over(self, ts: int, account_id_1: str, seq: int) -> None:
+        handoff = self.handoffs[self.shard]
+        while seq not in self.handed_over:
+            handed_seq, state = handoff.get()
+            self.handed_over[handed_seq] = state
+        self._merge_in(ts, account_id_1, self.handed_over.pop(seq))
+
+    def _merge_in(self, ts: int, account_id_1: str, state: AccountState) -> None:
+        account_id, row, scheduled, completed, transfers = state
+        # account numbers are local to a shard
+        node = self._add_account(account_id, row)
+        for payment in scheduled + completed:
+            payment.owner = node
+        for transfer in transfers.values():
+            transfer.source, transfer.target = node, UNKNOWN_TARGET
+
+        for payment in scheduled:
+            self.scheduled_payments[payment.payment_id] = payment
+            self.payment_scheduler.push(
+                payment.ts, parse_str_to_int(payment.payment_id[len("payment") :]), payment.payment_id
+            )
+        for payment in completed:
+            self.completed_payments[payment.payment_id] = payment
+
+        self.pending_transfers.update(transfers)
+        # an account holds few pending transfers; inserting each is cheaper than merging the whole queue
+        queue = self.transfer_expiry_queue
+        for ordinal in sorted(transfers):
+            queue.insert(bisect_left(queue, ordinal), ordinal)
+        self._index_outgoing(node, list(transfers))
+
+        self._merge_accounts(ts, account_id_1, account_id)
+
+    def _top_entries(self, ts: int, leaderboard: str, n: int | None) -> list[tuple[int, int, str]]:
+        board = self.activity_leaderboard if leaderboard == "activity" else self.spenders_leaderboard
+        return board.head(n)
+
+
+def serve(shard: int, inbox: Queue[Any], outbox: Queue[Any], handoffs: Sequence[Queue[Any]]) -> None:
+    bank = ShardBank(shard, handoffs)
+    while (message := inbox.get()) is not None:
+        outbox.put(bank.apply(*message))
+
+
+class ShardedBank:
+    """
+    Front end of a Bank partitioned by account id across num_shards worker processes. run() takes the operation
+    stream and yields one result per operation, in order. Close it, or use it as a context manager, to stop the
+    workers.
+    """
+
+    def __init__(self, num_shards: int | None = None, window_size: int = DEFAULT_WINDOW_SIZE) -> None:
+        self.num_shards = num_shards or os.cpu_count() or 1
+        self.window_size = window_size
+        self.TRANSFER_EXPIRATION_PERIOD = MILLISECONDS_IN_1_DAY
+
+        context = get_context()
+        self.inboxes: list[Queue[Any]] = [context.Queue() for _ in range(self.num_shards)]
+        self.outboxes: list[Queue[Any]] = [context.Queue() for _ in range(self.num_shards)]
+        handoffs: list[Queue[Any]] = [context.Queue() for _ in range(self.num_shards)]
+        self.workers = [
+            context.Process(
+                target=serve, args=(shard, self.inboxes[shard], self.outboxes[shard], handoffs), daemon=True
+            )
+            for shard in range(self.num_shards)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        # what a single Bank would know about accounts and transfers, plus where each account lives
+        self.account_shards: dict[str, int] = {}
+        self.aliases = AccountAliases()
+        # keyed by the sequence number of the transfer, including ones whose result is still in flight
+        self.pending_transfers: dict[int, Transfer] = {}
+        self.transfer_expiry_queue: deque[int] = deque()
+
+        # public ids -> shard ids, assigned in stream order as results come back
+        self.payment_ordinal = 0
+        self.payment_ids: dict[str, str] = {}
+        self.transfer_ordinal = 0
+        self.transfer_seqs: dict[int, int] = {}
+        self.payments_in_flight = 0
+        self.transfers_in_flight = 0
+
+        self.seq = 0
+        self.window = 0
+        self.window_timestamps = array("q")
+        self.window_ops: list[list[ShardOperation]] = [[] for _ in range(self.num_shards)]
+        # per shard, the windows of the messages whose reply has not been read yet
+        self.unread: list[deque[int]] = [deque() for _ in range(self.num_shards)]
+        self.replies: list[deque[Any]] = [deque() for _ in range(self.num_shards)]
+        # (window, kind, data) per operation whose result is not known yet, in stream order
+        self.slots: deque[tuple[int, str, Any]] = deque()
+        self.ready: deque[Any] = deque()
+
+        self.handlers: dict[str, Callable[..., None]] = {
+            op: getattr(self, f"_{method_name}") for op, (method_name, _) in QUERY_COMMANDS.items()
+        }
+
+    def __enter__(self) -> "ShardedBank":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def run(self, operations: Iterable[tuple[str, Sequence[Any]]]) -> Iterator[Any]:
+        for op, args in operations:
+            if op not in self.handlers:
+                raise ValueError(f"Unknown operation {op!r}")
+
+            self._expire_transfers(parse_str_to_int(args[0]))
+            self.handlers[op](parse_str_to_int(args[0]), *args[1:])
+            if len(self.window_timestamps) >= self.window_size:
+                self._flush()
+                # keep one window in flight while the shards work on the next
+                self._drain(self.window - 2)
+
+            while self.ready:
+                yield self.ready.popleft()
+
+        self._barrier()
+        while self.ready:
+            yield self.ready.popleft()
+
+    def _position(self, ts: int) -> int:
+        self.seq += 1
+        self.window_timestamps.append(ts)
+        return len(self.window_timestamps) - 1
+
+    def _send(self, shard: int, index: int, method_name: str, args: tuple[Any, ...], reply: bool = False) -> None:
+        self.window_ops[shard].append((index, self.seq, method_name, args, reply))
+
+    def _slot(self, kind: str, data: Any = None) -> None:
+        self.slots.append((self.window, kind, data))
+
+    def _flush(self) -> None:
+        for shard in range(self.num_shards):
+            self.inboxes[shard].put((self.window_timestamps, self.window_ops[shard]))
+            self.unread[shard].append(self.window)
+
+        self.window += 1
+        self.window_timestamps = array("q")
+        self.window_ops = [[] for _ in range(self.num_shards)]
+
+    def _read(self, shard: int) -> None:
+        self.unread[shard].popleft()
+        self.replies[shard].extend(self.outboxes[shard].get())
+
+    def _drain(self, window: int) -> None:
+        """Reads the replies to, and settles the results of, every window up to and including window."""
+        for shard in range(self.num_shards):
+            while self.unread[shard] and self.unread[shard][0] <= window:
+                self._read(shard)
+
+        while self.slots and self.slots[0][0] <= window:
+            _, kind, data = self.slots.popleft()
+            self.ready.append(self._settle(kind, data))
+
+    def _barrier(self) -> None:
+        self._flush()
+        self._drain(self.window - 1)
+
+    def _settle_until(self, settled: Callable[[], bool]) -> None:
+        """Settles results a window at a time, oldest first, until settled() holds or nothing is left in flight."""
+        while not settled() and self.slots:
+            window = self.slots[0][0]
+            if window == self.window:
+                self._flush()
+            self._drain(window)
+
+    def _settle(self, kind: str, data: Any) -> Any:
+        if kind == "value":
+            return data
+        if kind == "reply":
+            return self.replies[data].popleft()
+        if kind == "payment":
+            self.payments_in_flight -= 1
+            payment_key = self.replies[data].popleft()
+            return None if payment_key is None else self._assign_payment_id(payment_key)
+        if kind == "scheduled":
+            self.payments_in_flight -= 1
+            return self._assign_payment_id(data)
+        if kind == "transfer":
+            self.transfers_in_flight -= 1
+            shard, seq = data
+            if not self.replies[shard].popleft():
+                self.pending_transfers.pop(seq, None)
+                return ""
+
+            self.transfer_ordinal += 1
+            self.transfer_seqs[self.transfer_ordinal] = seq
+            return f"transfer{self.transfer_ordinal}"
+
+        # top queries
+        n = data
+        entries = heapq.merge(*(self.replies[shard].popleft() for shard in range(self.num_shards)))
+        return format_ranking(islice(entries, n) if n >= 0 else list(entries)[:n])
+
+    def _assign_payment_id(self, payment_key: str) -> str:
+        self.payment_ordinal += 1
+        payment_id = f"payment{self.payment_ordinal}"
+        self.payment_ids[payment_id] = payment_key
+        return payment_id
+
+    def _expire_transfers(self, ts: int) -> None:
+        queue = self.transfer_expiry_queue
+        while queue:
+            transfer = self.pending_transfers.get(queue[0])
+            if transfer is not None and ts - transfer.ts <= self.TRANSFER_EXPIRATION_PERIOD:
+                break
+
+            seq = queue.popleft()
+            self.pending_transfers.pop(seq, None)
+
+    def _create_account(self, ts: int, account_id: str) -> None:
+        index = self._position(ts)
+        if account_id in self.account_shards:
+            self._slot("value", False)
+            return
+
+        shard = shard_of(account_id, self.num_shards)
+        self.account_shards[account_id] = shard
+        self.aliases.add(account_id)
+        self._send(shard, index, "_create_account", (account_id,))
+        self._slot("value", True)
+
+    def _deposit(self, ts: int, account_id: str, amount: int) -> None:
+        index = self._position(ts)
+        shard = self.account_shards.get(account_id)
+        if shard is None:
+            self._slot("value", "")
+            return
+
+        self._send(shard, index, "_deposit", (account_id, amount), reply=True)
+        self._slot("reply", shard)
+
+    def _pay(self, ts: int, account_id: str, amount: int) -> None:
+        index = self._position(ts)
+        shard = self.account_shards.get(account_id)
+        if shard is None:
+            self._slot("value", None)
+            return
+
+        self._send(shard, index, "_pay", (account_id, amount), reply=True)
+        self._slot("payment", shard)
+        self.payments_in_flight += 1
+
+    def _schedule_payment(self, ts: int, account_id: str, amount: int, delay: int) -> None:
+        index = self._position(ts)
+        shard = self.account_shards.get(account_id)
+        if shard is None:
+            self._slot("value", "")
+            return
+
+        self._send(shard, index, "_schedule_payment", (account_id, amount, delay))
+        self._slot("scheduled", f"payment{self.seq}")
+        self.payments_in_flight += 1
+
+    def _payment_key(self, payment_id: str) -> str | None:
+        suffix = payment_id[len("payment") :]
+        if payment_id.startswith("payment") and suffix.isdigit():
+            # each payment in flight takes at most the next id, so only ids within reach of them are worth waiting for
+            ordinal = int(suffix)
+            self._settle_until(
+                lambda: payment_id in self.payment_ids or ordinal > self.payment_ordinal + self.payments_in_flight
+            )
+
+        return self.payment_ids.get(payment_id)
+
+    def _cancel_payment(self, ts: int, account_id: str, payment_id: str) -> None:
+        payment_key = self._payment_key(payment_id)
+        index = self._position(ts)
+        shard = self.account_shards.get(account_id)
+        if shard is None or payment_key is None:
+            self._slot("value", False)
+            return
+
+        self._send(shard, index, "_cancel_payment", (account_id, payment_key), reply=True)
+        self._slot("reply", shard)
+
+    def _get_payment_status(self, ts: int, account_id: str, payment_id: str) -> None:
+        payment_key = self._payment_key(payment_id)
+        index = self._position(ts)
+        resolved_account_id = self.aliases.resolve(account_id)
+        shard = self.account_shards.get(resolved_account_id) if resolved_account_id is not None else None
+        if shard is None or payment_key is None:
+            self._slot("value", None)
+            return
+
+        self._send(shard, index, "_get_payment_status", (resolved_account_id, payment_key), reply=True)
+        self._slot("reply", shard)
+
+    def _transfer(self, ts: int, source_account_id: str, target_account_id: str, amount: int) -> None:
+        index = self._position(ts)
+        if (
+            source_account_id == target_account_id
+            or source_account_id not in self.account_shards
+            or target_account_id not in self.account_shards
+        ):
+            self._slot("value", "")
+            return
+
+        shard = self.account_shards[source_account_id]
+        self._send(shard, index, "_transfer", (source_account_id, target_account_id, amount), reply=True)
+        nodes = self.aliases.nodes
+        self.pending_transfers[self.seq] = Transfer(ts, nodes[source_account_id], nodes[target_account_id], amount)
+        self.transfer_expiry_queue.append(self.seq)
+        self._slot("transfer", (shard, self.seq))
+        self.transfers_in_flight += 1
+
+    def _accept_transfer(self, ts: int, account_id: str, transfer_id: str) -> None:
+        ordinal = parse_str_to_int(transfer_id[len("transfer") :])
+        if ordinal not in self.transfer_seqs and self.transfers_in_flight:
+            # as for payments, only an id within reach of the transfers in flight is worth waiting for
+            self._settle_until(
+                lambda: ordinal in self.transfer_seqs or ordinal > self.transfer_ordinal + self.transfers_in_flight
+            )
+            self._expire_transfers(ts)
+
+        seq = self.transfer_seqs.get(ordinal)
+        transfer = self.pending_transfers.get(seq) if seq is not None else None
+        index = self._position(ts)
+        if seq is None or transfer is None or self.aliases.owner(transfer.target) != account_id:
+            self._slot("value", False)
+            return
+
+        del self.pending_transfers[seq]
+        self._send(self.account_shards[self.aliases.owner(transfer.source)], index, "_debit_transfer", (seq,))
+        self._send(self.account_shards[account_id], index, "_credit_transfer", (account_id, transfer.amount))
+        self._slot("value", True)
+
+    def _top_activity(self, ts: int, n: int) -> None:
+        self._top(ts, "activity", n)
+
+    def _top_spenders(self, ts: int, n: int) -> None:
+        self._top(ts, "spenders", n)
+
+    def _top(self, ts: int, leaderboard: str, n: int) -> None:
+        index = self._position(ts)
+        for shard in range(self.num_shards):
+            # a negative n drops entries from the end of the global ranking, so every shard sends all of its own
+            self._send(shard, index, "_top_entries", (leaderboard, n if n >= 0 else None), reply=True)
+        self._slot("top", n)
+
+    def _merge_accounts(self, ts: int, account_id_1: str, account_id_2: str) -> None:
+        index = self._position(ts)
+        if (
+            account_id_1 == account_id_2
+            or account_id_1 not in self.account_shards
+            or account_id_2 not in self.account_shards
+        ):
+            self._slot("value", False)
+            return
+
+        self.aliases.union(self.aliases.nodes[account_id_1], self.aliases.nodes[account_id_2])
+        shard_1 = self.account_shards[account_id_1]
+        shard_2 = self.account_shards.pop(account_id_2)
+        self._slot("value", True)
+        if shard_1 == shard_2:
+            self._send(shard_1, index, "_merge_accounts", (account_id_1, account_id_2))
+            return
+
+        # the shards hand the second account over between themselves, at this position in both their streams
+        self._send(shard_2, index, "_hand_over", (account_id_2, shard_1, self.seq))
+        self._send(shard_1, index, "_take_over", (account_id_1, self.seq))
+
+    def _get_balance(self, ts: int, account_id: str, time_at: int) -> None:
+        index = self._position(ts)
+        resolved_account_id = self.aliases.resolve(account_id)
+        shard = self.account_shards.get(resolved_account_id) if resolved_account_id is not None else None
+        if shard is None:
+            self._slot("value", None)
+            return
+
+        self._send(shard, index, "_get_balance", (resolved_account_id, time_at), reply=True)
+        self._slot("reply", shard)
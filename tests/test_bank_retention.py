@@ -0,0 +1,51 @@
+"""
+Reads of history compacted by Bank's retention are either exact or refused, checked against a Bank without
+retention.
+
+Run with python -m unittest (or pytest) from the repository root.
+"""
+
+import random
+import unittest
+
+from banking_system import MILLISECONDS_IN_1_DAY, Bank
+
+ACCOUNTS = [f"account{i}" for i in range(5)]
+CHECKPOINT_INTERVAL = 60 * 60 * 1000
+
+
+class RetentionTest(unittest.TestCase):
+    def test_old_balances_are_exact_or_refused(self) -> None:
+        rng = random.Random(7)
+        full = Bank()
+        compacted = Bank(history_retention=MILLISECONDS_IN_1_DAY, checkpoint_interval=CHECKPOINT_INTERVAL)
+        ts = 0
+        for account_id in ACCOUNTS:
+            ts += 1
+            full.create_account(str(ts), account_id)
+            compacted.create_account(str(ts), account_id)
+
+        exact = refused = 0
+        for _ in range(5_000):
+            # about one deposit per account per checkpoint interval, so some periods fold rows and some do not
+            ts += rng.randint(1, 2 * CHECKPOINT_INTERVAL // len(ACCOUNTS))
+            account_id = rng.choice(ACCOUNTS)
+            amount = rng.randint(1, 1_000)
+            self.assertEqual(compacted.deposit(str(ts), account_id, amount), full.deposit(str(ts), account_id, amount))
+
+            time_at = rng.randint(0, ts)
+            expected = full.get_balance(ts, account_id, time_at)
+            try:
+                self.assertEqual(compacted.get_balance(ts, account_id, time_at), expected)
+                exact += time_at < compacted.history_horizon
+            except ValueError:
+                self.assertLess(time_at, compacted.history_horizon)
+                refused += 1
+
+        # both kinds of reads of compacted history happened
+        self.assertGreater(exact, 0)
+        self.assertGreater(refused, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+DBServer and DBClient over a local socket: pipelined requests are answered in order, arguments that would change the
+request framing are rejected, and a connection that can no longer match responses to requests fails instead of
+hanging.
+
+Run with python -m unittest (or pytest) from the repository root.
+"""
+
+import asyncio
+import unittest
+from collections.abc import Sequence
+from typing import Any
+
+from db_server import DBClient, DBServer, ServerError
+
+TIMEOUT = 5.0
+
+
+class DBServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await DBServer().start("127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.client = DBClient("127.0.0.1", self.port, pool_size=1)
+        await self.client.connect()
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_pipelined_requests_are_answered_in_order(self) -> None:
+        queries: list[tuple[str, Sequence[Any]]] = []
+        for i in range(1, 201):
+            queries.append(("SET", (2 * i, "k", f"f{i}", i)))
+            queries.append(("GET", (2 * i + 1, "k", f"f{i}")))
+        results = await asyncio.wait_for(self.client.execute_many(queries), TIMEOUT)
+        self.assertEqual(results, [r for i in range(1, 201) for r in (None, i)])
+
+        gets = [self.client.get(1_000 + i, "k", f"f{i}") for i in range(1, 201)]
+        self.assertEqual(await asyncio.wait_for(asyncio.gather(*gets), TIMEOUT), list(range(1, 201)))
+        self.assertEqual(await self.client.scan(2_000, "k"), sorted(f"f{i}({i})" for i in range(1, 201)))
+
+    async def test_server_errors_keep_the_connection_usable(self) -> None:
+        await self.client.set(1, "k", "f", 1)
+        with self.assertRaises(ServerError):
+            await self.client.execute("GET_AT", 2, "k", "f", 1)
+        self.assertEqual(await asyncio.wait_for(self.client.get(3, "k", "f"), TIMEOUT), 1)
+
+    async def test_arguments_with_whitespace_are_rejected(self) -> None:
+        for field in ["x\nGET 4 k f", "a b", "a\tb", "a\rb", ""]:
+            with self.subTest(field=field), self.assertRaises(ValueError):
+                await self.client.set(4, "k", field, 7)
+
+        # nothing was sent, so the connection is still in step
+        await self.client.set(5, "k", "f", 7)
+        self.assertEqual(await asyncio.wait_for(self.client.get(6, "k", "f"), TIMEOUT), 7)
+        self.assertEqual(await self.client.scan(7, "k"), ["f(7)"])
+
+    async def test_unexpected_response_fails_the_connection(self) -> None:
+        (connection,) = self.client.connections
+        # one request line that the server reads as two requests
+        responses = await asyncio.wait_for(connection.send(["SET 4 k x 1\nGET 4 k x"]), TIMEOUT)
+        self.assertEqual(responses, [""])
+        await asyncio.wait_for(connection.receiver, TIMEOUT)
+
+        with self.assertRaisesRegex(ConnectionError, "Unexpected response"):
+            await asyncio.wait_for(self.client.get(5, "k", "x"), TIMEOUT)
+        await asyncio.wait_for(self.client.close(), TIMEOUT)
+
+    async def test_unanswered_requests_fail_when_the_server_closes(self) -> None:
+        async def hang_up(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            await reader.readline()
+            writer.close()
+
+        server = await asyncio.start_server(hang_up, "127.0.0.1", 0)
+        async with server, DBClient("127.0.0.1", server.sockets[0].getsockname()[1], pool_size=1) as client:
+            with self.assertRaises(ConnectionError):
+                await asyncio.wait_for(client.execute_many([("GET", (1, "k", "f")), ("GET", (2, "k", "f"))]), TIMEOUT)
+            with self.assertRaises(ConnectionError):
+                await asyncio.wait_for(client.get(3, "k", "f"), TIMEOUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
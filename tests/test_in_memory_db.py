@@ -0,0 +1,187 @@
+"""
+Point-in-time reads of InMemoryDB against the live database: get_at and scan_at must return what get and scan
+returned at that time, across restores and across compaction by history_retention, and reads older than the
+retained history must be refused.
+
+Run with python -m unittest (or pytest) from the repository root.
+"""
+
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.workloads import Operation
+from in_memory_db import QUERY_COMMANDS, InMemoryDB, main
+
+SEEDS = 10
+SIZE = 1_000
+KEYS = [f"key{i}" for i in range(4)]
+FIELDS = [f"field{i}" for i in range(6)]
+
+
+def random_operations(rng: random.Random, size: int) -> list[Operation]:
+    """Few keys and fields, short ttls and frequent backups and restores, so epochs and expiries keep interacting."""
+    ts = 0
+    backups: list[int] = []
+    ops: list[Operation] = []
+    for _ in range(size):
+        ts += rng.choice([1, 3, 20])
+        key, field = rng.choice(KEYS), rng.choice(FIELDS)
+        r = rng.random()
+        if r < 0.4:
+            ops.append(("SET", (ts, key, field, rng.randint(0, 5))))
+        elif r < 0.7:
+            ops.append(("SET_WITH_TTL", (ts, key, field, rng.randint(0, 5), rng.randint(1, 100))))
+        elif r < 0.85:
+            ops.append(("COMPARE_AND_DELETE", (ts, key, field, rng.randint(0, 5))))
+        elif r < 0.93 or not backups:
+            backups.append(ts)
+            ops.append(("BACKUP", (ts,)))
+        else:
+            ops.append(("RESTORE", (ts, rng.choice(backups))))
+
+    return ops
+
+
+def run_with_scans(db: InMemoryDB, ops: list[Operation]) -> dict[int, dict[str, list[str]]]:
+    """Runs ops and returns the scan of every key right after each operation, by timestamp."""
+    scans = {}
+    for op, args in ops:
+        getattr(db, QUERY_COMMANDS[op][0])(*args)
+        ts = args[0]
+        scans[ts] = {key: db.scan(ts, key) for key in KEYS}
+
+    return scans
+
+
+class PointInTimeTest(unittest.TestCase):
+    def check_reads(self, db: InMemoryDB, scans: dict[int, dict[str, list[str]]], now: int) -> int:
+        """Checks every retained timestamp and returns how many were answerable."""
+        answered = 0
+        for ts, by_key in scans.items():
+            if ts < db.history_horizon:
+                with self.assertRaises(ValueError):
+                    db.scan_at(now, KEYS[0], ts)
+                continue
+
+            answered += 1
+            for key, scan in by_key.items():
+                self.assertEqual(db.scan_at(now, key, ts), scan, (ts, key))
+                for field in FIELDS:
+                    value = next((int(s[len(field) + 1 : -1]) for s in scan if s.startswith(f"{field}(")), None)
+                    self.assertEqual(db.get_at(now, key, field, ts), value, (ts, key, field))
+
+        return answered
+
+    def test_reads_across_restores(self) -> None:
+        for seed in range(SEEDS):
+            with self.subTest(seed=seed):
+                ops = random_operations(random.Random(seed), SIZE)
+                db = InMemoryDB(history=True)
+                scans = run_with_scans(db, ops)
+                self.assertGreater(len(db.epochs), 1)
+                self.assertEqual(self.check_reads(db, scans, ops[-1][1][0] + 1), len(scans))
+
+    def test_reads_across_retention_compaction(self) -> None:
+        for seed in range(SEEDS):
+            with self.subTest(seed=seed):
+                ops = random_operations(random.Random(seed), SIZE)
+                end = ops[-1][1][0]
+                db = InMemoryDB(history=True, history_retention=end // 5)
+                scans = run_with_scans(db, ops)
+                self.assertGreater(db.history_horizon, 0)
+                answered = self.check_reads(db, scans, end + 1)
+                self.assertTrue(0 < answered < len(scans))
+
+    def test_reads_before_the_first_write(self) -> None:
+        db = InMemoryDB(history=True)
+        db.set(5, "k", "f", 1)
+        self.assertIsNone(db.get_at(6, "k", "f", 4))
+        self.assertEqual(db.scan_at(6, "k", 4), [])
+        self.assertEqual(db.scan_at(6, "k", 5), ["f(1)"])
+
+    def test_reads_need_history(self) -> None:
+        db = InMemoryDB()
+        db.set(1, "k", "f", 1)
+        with self.assertRaises(ValueError):
+            db.get_at(2, "k", "f", 1)
+
+
+class BackupTest(unittest.TestCase):
+    def test_restore_returns_the_backed_up_records(self) -> None:
+        keys = [f"key{i}" for i in range(200)]
+        for seed in range(SEEDS):
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                db = InMemoryDB(reap_budget=rng.choice([1, 64]))
+                backups: dict[int, dict[str, list[str]]] = {}
+                ts = 0
+                for _ in range(3_000):
+                    ts += rng.choice([1, 20])
+                    key, field = rng.choice(keys), rng.choice(FIELDS)
+                    r = rng.random()
+                    if r < 0.4:
+                        db.set_with_ttl(ts, key, field, 1, rng.randint(1, 500))
+                    elif r < 0.6:
+                        db.set(ts, key, field, 2)
+                    elif r < 0.8:
+                        db.compare_and_delete(ts, key, field, 2)
+                    elif r < 0.9:
+                        scans = {key: scan for key in keys if (scan := db.scan(ts, key))}
+                        self.assertEqual(db.backup(ts), str(len(scans)))
+                        backups[ts] = scans
+                    elif backups:
+                        backup_ts = rng.choice(list(backups))
+                        db.restore(ts, backup_ts)
+                        self.assertEqual({key: scan for key in keys if (scan := db.scan(ts, key))}, backups[backup_ts])
+                self.assertTrue(any(backup.parent is not None for backup in db.backups.values()))
+
+
+class ReapTest(unittest.TestCase):
+    def test_restored_fields_are_queued_a_budget_at_a_time(self) -> None:
+        db = InMemoryDB(reap_budget=8)
+        for i in range(100):
+            db.set_with_ttl(i + 1, "big", f"f{i}", i, 1_000)
+        db.set(101, "small", "f", 1)
+        db.backup(200)
+        db.restore(300, 200)
+
+        queued = []
+        for ts in range(301, 320):
+            db.get(ts, "big", "f0")
+            queued.append(len(db.expiry_heap))
+        self.assertEqual(queued[0], 8)
+        self.assertTrue(all(0 < b - a <= 8 for a, b in zip(queued, queued[1:], strict=False) if a < 100))
+        self.assertEqual(queued[-1], 100)
+
+        # restored fields keep the ttl they had left at backup time, and are reaped when it runs out
+        self.assertEqual(db.get(1_000, "big", "f99"), 99)
+        for ts in range(1_200, 1_300):
+            db.get(ts, "none", "f")
+        self.assertEqual(list(db.records), ["small"])
+
+
+class CliTest(unittest.TestCase):
+    def run_cli(self, queries: str, *options: str) -> str:
+        with tempfile.TemporaryDirectory() as tmp:
+            path, out = Path(tmp) / "queries.txt", Path(tmp) / "results.txt"
+            path.write_text(queries)
+            main([*options, str(path), "-o", str(out)])
+            return out.read_text()
+
+    def test_point_in_time_commands(self) -> None:
+        queries = "SET 1 k f 5\nSET 10 k f 6\nGET_AT 11 k f 5\nSCAN_AT 12 k 10\nSCAN_BY_PREFIX_AT 13 k g 10\n"
+        self.assertEqual(self.run_cli(queries, "--history"), "\n\n5\nf(6)\n\n")
+        with self.assertRaises(ValueError):
+            self.run_cli("SET 1 k f 5\nGET_AT 2 k f 1\n")
+
+    def test_history_retention(self) -> None:
+        queries = "SET 1 k f 5\nSET 100 k f 6\nGET_AT 101 k f 95\n"
+        self.assertEqual(self.run_cli(queries, "--history-retention", "10"), "\n\n5\n")
+        with self.assertRaises(ValueError):
+            self.run_cli(queries.replace("95", "50"), "--history-retention", "10")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+ShardedBank against a single Bank on randomized operation streams: both must return the same result for every
+operation, across shard counts and window sizes.
+
+Run with python -m unittest (or pytest) from the repository root.
+"""
+
+import random
+import unittest
+
+from banking_system import MILLISECONDS_IN_1_DAY, QUERY_COMMANDS, Bank
+from benchmarks.workloads import Operation
+from sharded_bank import ShardedBank
+
+SEEDS = 12
+SIZE = 1_500
+
+
+def random_operations(rng: random.Random, size: int) -> list[Operation]:
+    """A few accounts and large time steps, so transfers, payments and merges keep interacting and expiring."""
+    account_ids = [f"account{i}" for i in range(10)]
+    ts = 0
+    ops: list[Operation] = []
+    for _ in range(size):
+        ts += rng.choice([1, 5, 1_000, MILLISECONDS_IN_1_DAY // 3])
+        account_id, other_id = rng.choice(account_ids), rng.choice(account_ids)
+        r = rng.random()
+        if r < 0.1:
+            ops.append(("CREATE_ACCOUNT", (ts, account_id)))
+        elif r < 0.3:
+            ops.append(("DEPOSIT", (ts, account_id, rng.randint(1, 500))))
+        elif r < 0.4:
+            ops.append(("PAY", (ts, account_id, rng.randint(1, 300))))
+        elif r < 0.5:
+            ops.append(("TRANSFER", (ts, account_id, other_id, rng.randint(1, 300))))
+        elif r < 0.58:
+            ops.append(("ACCEPT_TRANSFER", (ts, account_id, f"transfer{rng.randint(1, 60)}")))
+        elif r < 0.64:
+            delay = rng.choice([0, 10, MILLISECONDS_IN_1_DAY])
+            ops.append(("SCHEDULE_PAYMENT", (ts, account_id, rng.randint(1, 200), delay)))
+        elif r < 0.68:
+            ops.append(("CANCEL_PAYMENT", (ts, account_id, f"payment{rng.randint(1, 60)}")))
+        elif r < 0.74:
+            ops.append(("TOP_ACTIVITY", (ts, rng.choice([-1, 0, 1, 3, 100]))))
+        elif r < 0.8:
+            ops.append(("TOP_SPENDERS", (ts, rng.choice([-1, 0, 1, 3, 100]))))
+        elif r < 0.84:
+            ops.append(("MERGE_ACCOUNTS", (ts, account_id, other_id)))
+        elif r < 0.92:
+            ops.append(("GET_BALANCE", (ts, account_id, rng.randint(1, ts))))
+        else:
+            ops.append(("GET_PAYMENT_STATUS", (ts, account_id, f"payment{rng.randint(1, 60)}")))
+
+    return ops
+
+
+class ShardedBankEquivalenceTest(unittest.TestCase):
+    def test_matches_single_bank(self) -> None:
+        for seed in range(SEEDS):
+            rng = random.Random(seed)
+            ops = random_operations(rng, SIZE)
+            bank = Bank()
+            expected = [getattr(bank, QUERY_COMMANDS[op][0])(*args) for op, args in ops]
+
+            num_shards, window_size = rng.choice([2, 3, 4]), rng.choice([1, 5, 50, 4096])
+            with self.subTest(seed=seed, num_shards=num_shards, window_size=window_size):
+                with ShardedBank(num_shards, window_size) as sharded:
+                    self.assertEqual(list(sharded.run(ops)), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()